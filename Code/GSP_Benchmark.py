@@ -0,0 +1,278 @@
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This script benchmarks the processing pipeline in GSP_Data_Processing.py on synthetic gaze data.
+
+The synthetic data is generated deterministically (seeded) in the format of the screen gaze data written by
+App.write_data() (columns: time, gaze_point_x, gaze_point_y), with fixations, saccades and track loss
+(NaN gaps), at configurable sampling rates and cohort sizes.
+
+For each stage (fixation detection (I-DT, I-VT), fixation table, phase split, AOI split, whole subject) wall time
+and peak memory are reported. The conversion of fixations into a table (fixations_to_df()) is measured for
+increasing numbers of fixations, to show that its cost is linear in the number of fixations, e.g.:
+
+    python GSP_Benchmark.py --rates 120 600 1200 --subjects 2 --trials 8 --fixations 100 400 1600 6400 \
+        --out benchmark.csv
+
+Author:  Florian Bednarski et al.
+Contact: fteichmann[at]cbs.mpg.de
+Years:   2021-2023
+"""
+
+# %% Import
+import argparse
+import os
+import tempfile
+from time import perf_counter
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import GSP_Data_Processing as gsp
+
+# %% Set global vars & paths  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+SEED: int = 2023
+SAMPLING_RATES = [120, 300, 600, 1200]  # in Hz
+FIXATION_COUNTS = [100, 400, 1600, 6400]  # numbers of fixations for fixations_to_df()
+SCREEN_SIZE = (1280, 1024)  # width, height in pixels
+
+# Timing of a trial (in seconds), see App.__init__() in gaze_scratch_paradigm.py
+BASELINE_END = 9.  # baseline eye tracking stops just before the transition video
+CONTINGENT_START = 12.5  # image is shown and contingent phase starts
+CONTINGENT_MAX = 30.  # contingent phase ends latest after 30 seconds
+DISRUPTION = 5.  # length of disruption phase
+
+
+# %% Functions  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+def _gaze_trace(rng: np.random.Generator, time: np.ndarray, fix_dur: tuple = (.1, .8),
+                sacc_dur: tuple = (.02, .06), noise: float = 5., gap_rate: float = .3,
+                gap_dur: tuple = (.1, .4)):
+    """
+    Generate gaze coordinates for given time stamps as sequence of fixations and saccades with NaN gaps.
+
+    :param time: time stamps (in seconds)
+    :param fix_dur: range of fixation durations (in seconds)
+    :param sacc_dur: range of saccade durations (in seconds)
+    :param noise: standard deviation of gaze samples around the fixation target (in pixels)
+    :param gap_rate: rate of track loss (blinks etc.) per second
+    :param gap_dur: range of durations of track loss (in seconds)
+    :return: x, y
+    """
+    n = len(time)
+    x = np.empty(n)
+    y = np.empty(n)
+    if n == 0:
+        return x, y
+
+    # Sequence of fixation targets with their onsets, the saccade to the next target follows each fixation
+    t_now = time[0]
+    pos = rng.uniform((0, 0), SCREEN_SIZE)
+    while t_now <= time[-1]:
+        t_fix_end = t_now + rng.uniform(*fix_dur)
+        t_sacc_end = t_fix_end + rng.uniform(*sacc_dur)
+        target = rng.uniform((0, 0), SCREEN_SIZE)
+
+        fix = (time >= t_now) & (time < t_fix_end)
+        x[fix] = pos[0] + rng.normal(0, noise, fix.sum())
+        y[fix] = pos[1] + rng.normal(0, noise, fix.sum())
+
+        sacc = (time >= t_fix_end) & (time < t_sacc_end)
+        frac = (time[sacc] - t_fix_end) / (t_sacc_end - t_fix_end)
+        x[sacc] = pos[0] + frac * (target[0] - pos[0])
+        y[sacc] = pos[1] + frac * (target[1] - pos[1])
+
+        pos = target
+        t_now = t_sacc_end
+
+    # Track loss
+    n_gaps = rng.poisson(gap_rate * (time[-1] - time[0]))
+    for t_gap in rng.uniform(time[0], time[-1], n_gaps):
+        gap = (time >= t_gap) & (time < t_gap + rng.uniform(*gap_dur))
+        x[gap] = np.nan
+        y[gap] = np.nan
+
+    return x, y
+
+
+def generate_trial(rng: np.random.Generator, sampling_rate: float = 120, contingent_duration: float = None,
+                   **kwargs) -> pd.DataFrame:
+    """
+    Generate the gaze data of one trial.
+
+    Samples are recorded from the start of the trial until the end of the baseline, and from the start
+    of the contingent phase until the end of the disruption phase (as in the experiment).
+
+    :param rng: random number generator
+    :param sampling_rate: sampling rate of eye tracker (in Hz)
+    :param contingent_duration: length of contingent phase in seconds (None: random, up to CONTINGENT_MAX)
+    :param kwargs: passed on to _gaze_trace()
+    :return: gaze data with the columns time, gaze_point_x, gaze_point_y
+    """
+    if contingent_duration is None:
+        contingent_duration = rng.uniform(10, CONTINGENT_MAX)
+    t_end = CONTINGENT_START + contingent_duration + DISRUPTION
+    time = np.arange(0, t_end, 1 / sampling_rate)
+    time = time[(time < BASELINE_END) | (time >= CONTINGENT_START)]
+    time = time + rng.normal(0, .05 / sampling_rate, len(time))  # jitter of time stamps
+    time.sort()
+
+    x, y = _gaze_trace(rng, time, **kwargs)
+    return pd.DataFrame({'time': time, 'gaze_point_x': x, 'gaze_point_y': y})
+
+
+def generate_cohort(data_root: str, n_subjects: int = 2, n_trials: int = 8, sampling_rate: float = 120,
+                    conditions: tuple = ("rise",), seed: int = SEED) -> list:
+    """
+    Write synthetic gaze data of a cohort to '<data_root>/<ID>/<condition>/<trial>.csv'.
+
+    :return: list of (subject ID, condition) tuples (see GSP_Data_Processing.discover_subjects())
+    """
+    rng = np.random.default_rng(seed)
+    for i_subject in range(n_subjects):
+        for condition in conditions:
+            condition_path = os.path.join(data_root, f"ID_{i_subject + 1}", condition.lower())
+            os.makedirs(condition_path, exist_ok=True)
+            for i_trial in range(n_trials):
+                generate_trial(rng, sampling_rate=sampling_rate).to_csv(
+                    os.path.join(condition_path, f"{i_trial + 1}trial{condition.lower()}.csv"), index=False)
+    return gsp.discover_subjects(data_root)
+
+
+def measure(func, *args, repeat: int = 3, **kwargs):
+    """
+    Measure wall time (best of repeat runs) and peak memory (traced allocations) of a function call.
+
+    :return: result of func, time in seconds, peak memory in MB
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, perf_counter() - start)
+
+    tracemalloc.start()
+    func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak / 1024 ** 2
+
+
+def benchmark_stages(sampling_rate: float, n_subjects: int = 2, n_trials: int = 8, repeat: int = 3,
+                     seed: int = SEED) -> pd.DataFrame:
+    """
+    Benchmark the stages of the processing pipeline for one sampling rate.
+
+    :return: table with the columns 'Rate', 'Stage', 'Samples', 'Time', 'Peak_MB'
+    """
+    rng = np.random.default_rng(seed)
+    trial = generate_trial(rng, sampling_rate=sampling_rate, contingent_duration=CONTINGENT_MAX)
+    n_samples = len(trial)
+    clean = trial.dropna()
+    x = clean['gaze_point_x'].to_numpy()
+    y = clean['gaze_point_y'].to_numpy()
+    time = clean['time'].to_numpy()
+    aoi_definition = gsp.AOI_DEFINITIONS[gsp.AOI]
+
+    def _aoi_split():
+        labels = gsp.label_aoi(x, y, aoi_definition)
+        order, offsets = gsp.group_by_aoi(labels, n_aoi=len(aoi_definition))
+        return [clean.iloc[order[offsets[i]:offsets[i + 1]]] for i in range(1, len(offsets) - 1)]
+
+    stages = {
+        "fixation_detection (reference)": lambda: gsp.fixation_detection(x.tolist(), y.tolist(), time.tolist()),
+        "fixation_detection_np": lambda: gsp.fixation_detection_np(x, y, time),
+        "fixation_detection_ivt": lambda: gsp.fixation_detection_ivt(x, y, time, offsets=[0, len(x)]),
+        "compute_df_e_fix": lambda: gsp.compute_df_e_fix(clean),
+        "phase split": lambda: gsp.phase_index(trial['time'].to_numpy()),
+        "AOI split": _aoi_split,
+    }
+    rows = []
+    for stage, func in stages.items():
+        _, t, peak = measure(func, repeat=repeat)
+        rows.append([sampling_rate, stage, n_samples, t, peak])
+
+    # Whole pipeline for a synthetic cohort
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_root = os.path.join(tmp_dir, "Data")
+        subjects = generate_cohort(data_root, n_subjects=n_subjects, n_trials=n_trials,
+                                   sampling_rate=sampling_rate, seed=seed)
+        n_cohort = sum(len(pd.read_csv(os.path.join(data_root, subject_id, condition.lower(), fn)))
+                       for subject_id, condition in subjects
+                       for fn in os.listdir(os.path.join(data_root, subject_id, condition.lower())))
+
+        def _process():
+            return gsp.process_cohort(subjects, data_root=data_root, save_path_dur=tmp_dir,
+                                      save_path_fix=tmp_dir, use_cache=False, verbose=False,
+                                      use_store=False)
+
+        _, t, peak = measure(_process, repeat=1)
+        rows.append([sampling_rate, f"process_cohort ({n_subjects} x {n_trials} trials)", n_cohort, t, peak])
+
+    return pd.DataFrame(rows, columns=['Rate', 'Stage', 'Samples', 'Time', 'Peak_MB'])
+
+
+def benchmark_fixations_to_df(counts: list = None, repeat: int = 3, seed: int = SEED) -> pd.DataFrame:
+    """
+    Benchmark fixations_to_df() for increasing numbers of fixations, given as structured array (see
+    fixation_detection_np()) and as list (see fixation_detection()).
+
+    :param counts: numbers of fixations (default: FIXATION_COUNTS)
+    :return: table with the columns 'Rate', 'Stage', 'Samples', 'Time', 'Peak_MB' (Samples: number of fixations)
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for n_fix in counts or FIXATION_COUNTS:
+        start = np.sort(rng.uniform(0, 60, n_fix))
+        duration = rng.uniform(.1, .8, n_fix)
+        e_fix = np.empty(n_fix, dtype=gsp.FIXATION_DTYPE)
+        e_fix['start'] = start
+        e_fix['end'] = start + duration
+        e_fix['duration'] = duration
+        e_fix['x'] = rng.uniform(0, SCREEN_SIZE[0], n_fix)
+        e_fix['y'] = rng.uniform(0, SCREEN_SIZE[1], n_fix)
+        e_fix_list = e_fix.tolist()
+
+        for stage, fixations in [("fixations_to_df (array)", e_fix), ("fixations_to_df (list)", e_fix_list)]:
+            _, t, peak = measure(gsp.fixations_to_df, fixations, repeat=repeat)
+            rows.append([np.nan, f"{stage} {n_fix} fixations", n_fix, t, peak])
+
+    return pd.DataFrame(rows, columns=['Rate', 'Stage', 'Samples', 'Time', 'Peak_MB'])
+
+
+def main():
+    df_bench = pd.concat([benchmark_stages(sampling_rate=rate, n_subjects=FLAGS.subjects, n_trials=FLAGS.trials,
+                                           repeat=FLAGS.repeat, seed=FLAGS.seed)
+                          for rate in FLAGS.rates]
+                         + [benchmark_fixations_to_df(FLAGS.fixations, repeat=FLAGS.repeat, seed=FLAGS.seed)],
+                         ignore_index=True)
+    df_bench['us_per_Sample'] = df_bench['Time'] / df_bench['Samples'] * 1e6
+
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', 200):
+        print(df_bench)
+    if FLAGS.out:
+        df_bench.to_csv(FLAGS.out, sep=",", index=False)
+
+
+# %% __main__ o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+if __name__ == "__main__":
+    # Setup parser
+    parser = argparse.ArgumentParser(description='Benchmark processing pipeline on synthetic gaze data.')
+    parser.add_argument('--rates', type=float, nargs='+', help='Sampling rates in Hz', default=SAMPLING_RATES)
+    parser.add_argument('--subjects', type=int, help='Number of subjects in synthetic cohort', default=2)
+    parser.add_argument('--trials', type=int, help='Number of trials per subject', default=8)
+    parser.add_argument('--fixations', type=int, nargs='+', help='Numbers of fixations for fixations_to_df()',
+                        default=FIXATION_COUNTS)
+    parser.add_argument('--repeat', type=int, help='Repetitions per stage (best time is reported)', default=3)
+    parser.add_argument('--seed', type=int, help='Seed of synthetic data', default=SEED)
+    parser.add_argument('--out', type=str, help='Path to save results as csv', default="")
+
+    # Parse arguments
+    FLAGS, unparsed = parser.parse_known_args()
+
+    # %% Run main
+    main()
+#  o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o END
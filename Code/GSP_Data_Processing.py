@@ -1,16 +1,15 @@
 # !/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-This code processes the raw data from the eye-tracker into five dictionaries:
+This code processes the raw data from the eye-tracker trial by trial (see iter_trials() and process_trial()):
+the gaze data of a trial is separated into PHASES and areas of interest (AOI, see AOI_DEFINITIONS), and only
+the fixations and dwell times of the trial are kept, in two dictionaries:
 
-trial_phase_data: contains gaze data separated into trials and PHASES
 fixation_data: contains fixation data for trials and PHASES
+fixation_data_aoi: contains only fixation data for all AOIs (e.g., 'drop' and 'rise')
 
-The following three dictionaries are required for the analysis of areas of interest (AOI):
-
-trial_phase_aoi_data: contains only gaze data for both AOIs separated into trials and PHASES
-fixation_data_drop: contains only fixation data for AOI drop
-fixation_data_rise: contains only fixation data for AOI rise
+Memory does not grow with the number of trials, but each trial is loaded whole (its phases are defined relative to
+its end, see phase_index()): peak memory is a small multiple of the gaze data of the longest trial.
 
 Author:  Florian Bednarski et al.
 Contact: fteichmann[at]cbs.mpg.de
@@ -19,8 +18,14 @@ Years:   2021-2023
 
 # %% Import
 import argparse
-from copy import deepcopy
+from bisect import bisect_left
+from contextlib import contextmanager
+import io
+import json
 import os
+import sys
+from time import perf_counter
+import tracemalloc
 
 import pandas as pd
 import numpy as np
@@ -35,58 +40,361 @@ CONDITION: str = "Rise"  # condition for Rise/Drop Trials
 DATA_ROOT_PATH: str = "Data"  # INSERT PATH TO DATA FILES IF REQUIRED
 SAVE_PATH_DF_RISE: str = ""  # INSERT PATH TO SAVE DF
 SAVE_PATH_FIXATION_OVERALL: str = ""  # INSERT PATH TO SAVE FIXATION OVERALL
+CACHE_PATH: str = ".gsp_cache"  # binary cache of parsed trial csv files
+RESULTS_PATH: str = ".gsp_results"  # results store of trial stages (QC, fixations, sweep, heatmaps)
+OSF_URL: str = "https://files.de-1.osf.io/v1/resources/xrbzg/providers/osfstorage/?zip="  # archive of study data
+MANIFEST_NAME: str = ".gsp_manifest.json"  # files extracted by download_study_data()
+MANIFEST_ARCHIVE: str = "__archive__"  # entry of the manifest with the url and the member names of the archive
 
 # Globals vars
 PHASES = ["baseline", "contingent", "disruption"]
+FIXATION_COLUMNS = ['Start', 'End', 'Duration', 'X', 'Y']
+# Fixation detection: dispersion threshold (in pixels) and minimal duration (in seconds)
+FIXATION_MAX_DIST: float = 25
+FIXATION_MIN_DUR: float = 0.25
+# Fixation detector: 'idt' (dispersion, PyTrack) or 'ivt' (velocity threshold, see fixation_detection_ivt())
+FIXATION_DETECTORS = ["idt", "ivt"]
+FIXATION_DETECTOR: str = "idt"
+FIXATION_MAX_VELOCITY: float = 1000.  # I-VT: velocity threshold (in pixels per second)
+FIXATION_VELOCITY_WINDOW: float = 0.02  # I-VT: time window of sample velocities (in seconds)
+FIXATION_MAX_GAP: float = 0.075  # I-VT: longest time gap within and between merged fixations (in seconds)
+FLIP_Y: int = 1024  # y-coordinates are flipped (FLIP_Y - y) for fixation detection, None: no flip
+# Resampling onto a uniform time grid (optional, see resample_trial())
+RESAMPLE_RATE: float = 120.  # rate of time grid (in Hz), as the eye tracker of the study
+RESAMPLE_MAX_GAP: float = 0.075  # longest gap of valid data which is interpolated (in seconds)
+# Pre-registered inclusion criteria: minimal duration of valid gaze data per phase (in seconds)
+QC_MIN_VALID = {'baseline': 1, 'contingent': 10, 'disruption': .5}
+QC_COLUMNS = ['Phase', 'Samples', 'Valid_Samples', 'NaN_Ratio', 'Duration', 'Valid_Duration', 'Longest_Gap',
+              'Sampling_Rate', 'Pass']
+DATASET_KEYS = ['ID', 'Condition', 'Phase', 'Trial', 'AOI']  # partition keys of output tables, see write_dataset()
+
+# Areas of interest (AOI) in screen pixels (origin: top left corner of the screen).
+# Each AOI consists of rectangles (x_min, y_min, x_max, y_max), borders excluded, and/or polygons [(x, y), ...].
+# 'drop' and 'rise' are required for the DLS, further AOIs can be added and are labelled in the same pass.
+AOI_SCREEN_SIZE = (1280, 1024)  # screen size the AOI definitions refer to
+AOI_DEFINITIONS = {
+    # Quadrants focused on objects in corners of the screen
+    "corners": {
+        "drop": [(-np.inf, -np.inf, 478, 382), (802, 642, np.inf, np.inf)],  # top left | bottom right
+        "rise": [(802, -np.inf, np.inf, 382), (-np.inf, 642, 478, np.inf)],  # top right | bottom left
+    },
+    # Full Screen divided in four quadrants
+    "quadrants": {
+        "drop": [(-np.inf, -np.inf, 640, 512), (640, 512, np.inf, np.inf)],
+        "rise": [(640, -np.inf, np.inf, 512), (-np.inf, 512, 640, np.inf)],
+    },
+}
+AOI: str = "corners"  # AOI definition used for processing
+
+# Heatmaps: size of tiles in pixels, as the blocks of the scratch grid (w_tiles in gaze_scratch_paradigm.py)
+HEATMAP_TILE: int = AOI_SCREEN_SIZE[0] // 16
 
 
 # %% Functions  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
 
-def download_study_data(stimuli_only: bool, verbose: bool = True) -> None:
-    """Download study data from OSF."""
+class _HTTPRangeFile(io.RawIOBase):
+    """Read-only, seekable file over HTTP, each read is a range request (server must support 'Range')."""
+
+    def __init__(self, url: str, size: int):
+        self.url = url
+        self.size = size
+        self._pos = 0
+
+    @classmethod
+    def open(cls, url: str):
+        """Return buffered range file, or None if the server does not support range requests."""
+        from urllib.request import Request, urlopen
+
+        with urlopen(Request(url, headers={"Range": "bytes=0-0"})) as response:
+            content_range = response.headers.get("Content-Range", "")
+            if response.status != 206 or "/" not in content_range or content_range.endswith("*"):
+                return None
+        return io.BufferedReader(cls(url, size=int(content_range.rsplit("/", 1)[1])), buffer_size=1 << 20)
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._pos = max(0, {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.size}[whence] + offset)
+        return self._pos
+
+    def readinto(self, b) -> int:
+        from urllib.request import Request, urlopen
+
+        n = min(len(b), self.size - self._pos)
+        if n <= 0:
+            return 0
+        request = Request(self.url, headers={"Range": f"bytes={self._pos}-{self._pos + n - 1}"})
+        with urlopen(request) as response:
+            data = response.read(n)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+class _FileSlice(io.RawIOBase):
+    """Read-only view on the bytes [offset, offset + size) of a seekable file (e.g., a stored zip member)."""
+
+    def __init__(self, fp, offset: int, size: int):
+        self.fp = fp
+        self.offset = offset
+        self.size = size
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._pos = max(0, {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.size}[whence] + offset)
+        return self._pos
+
+    def readinto(self, b) -> int:
+        n = min(len(b), self.size - self._pos)
+        if n <= 0:
+            return 0
+        self.fp.seek(self.offset + self._pos)
+        data = self.fp.read(n)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def _download_resume(url: str, filename: str, verbose: bool = True) -> str:
+    """
+    Download url to filename, interrupted downloads ('<filename>.part') are resumed if the server supports it.
+
+    :return: filename
+    """
     import shutil
-    from urllib.request import urlretrieve
+    from urllib.request import Request, urlopen
+
+    if os.path.isfile(filename):
+        return filename
+    part = filename + ".part"
+    n_done = os.path.getsize(part) if os.path.isfile(part) else 0
+    request = Request(url, headers={"Range": f"bytes={n_done}-"} if n_done else {})
+    with urlopen(request) as response:
+        resumed = n_done > 0 and response.status == 206
+        if verbose and n_done:
+            print(f"Resume download at {n_done / 1024 ** 2:.1f} MB." if resumed else "Restart download.")
+        with open(part, "ab" if resumed else "wb") as f:
+            shutil.copyfileobj(response, f, length=1 << 20)
+    os.replace(part, filename)
+    return filename
+
+
+def _open_nested_zip(zip_ref, name: str):
+    """Open zip file member of zip_ref as zip file without extracting it to disk."""
+    import struct
     import zipfile
 
-    # Download data
-    if verbose:
-        print("Downloading data from OSF ...")
-    fname, headers = urlretrieve(
-        url="https://files.de-1.osf.io/v1/resources/xrbzg/providers/osfstorage/?zip=",
-        filename="osfstorage-archive.zip")
-    if verbose:
-        print(f"Data downloaded to '{fname}'.")
-
-    # Unzip data
-    with zipfile.ZipFile(fname, 'r') as zip_ref:
-        zip_ref.extractall()
-
-    # Remove zip file
-    os.remove(fname)
-    data_dir: str = "Data"
-    if stimuli_only:
-        # Remove data files
-        shutil.rmtree(data_dir)
+    info = zip_ref.getinfo(name)
+    if info.compress_type == zipfile.ZIP_STORED:
+        # Read stored member directly from the archive (local file header: 30 bytes + file name + extra field)
+        zip_ref.fp.seek(info.header_offset)
+        header = zip_ref.fp.read(30)
+        len_name, len_extra = struct.unpack("<HH", header[26:30])
+        return zipfile.ZipFile(io.BufferedReader(_FileSlice(
+            zip_ref.fp, offset=info.header_offset + 30 + len_name + len_extra, size=info.file_size)))
+    return zipfile.ZipFile(zip_ref.open(name))  # seekable, but decompressed again for backward seeks
+
+
+def _is_data_member(name: str, ids=None, conditions=None) -> bool:
+    """
+    Check if the member 'Data/<ID>/<condition>/...' of the data archive matches the subject IDs and conditions.
+
+    :param ids: list of subject IDs (also glob patterns, e.g., 'ID_5*'), None: all subjects
+    :param conditions: list of conditions (e.g., ['Rise']), None: all conditions
+    """
+    from fnmatch import fnmatch
+
+    parts = [part for part in name.split("/") if part]
+    if parts and parts[0] == "Data":
+        parts = parts[1:]
+    if ids is not None and not (parts and any(fnmatch(parts[0], pattern) for pattern in ids)):
+        return False
+    if conditions is not None and not (
+            len(parts) > 1 and parts[1].lower() in [condition.lower() for condition in conditions]):
+        return False
+    return True
+
+
+def _extract_members(zip_ref, names, target_dir: str, manifest: dict, verbose: bool = True) -> int:
+    """
+    Extract members of zip file to target_dir, skipping files already present (see download_study_data()).
+
+    Files are written to a temporary file first, so interrupted extractions leave no incomplete files.
+
+    :return: number of extracted files
+    """
+    import shutil
+    import zlib
+
+    n_extracted = 0
+    for name in names:
+        info = zip_ref.getinfo(name)
+        path = os.path.join(target_dir, *name.split("/"))
+        if info.is_dir():
+            os.makedirs(path, exist_ok=True)
+            continue
+
+        # Skip files already present: known from manifest (size, time of modification) or same checksum
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            entry = manifest.get(name)
+            if entry is not None and entry["crc"] == info.CRC and entry["size"] == stat.st_size == info.file_size \
+                    and entry["mtime_ns"] == stat.st_mtime_ns:
+                continue
+            if stat.st_size == info.file_size:
+                crc = 0
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        crc = zlib.crc32(block, crc)
+                if crc == info.CRC:
+                    manifest[name] = {"crc": info.CRC, "size": info.file_size, "mtime_ns": stat.st_mtime_ns}
+                    continue
+
+        # Stream member to disk (checksum of member is verified by zipfile while reading)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with zip_ref.open(info) as source, open(path + ".tmp", "wb") as f:
+            shutil.copyfileobj(source, f, length=1 << 20)
+        os.replace(path + ".tmp", path)
+        manifest[name] = {"crc": info.CRC, "size": info.file_size, "mtime_ns": os.stat(path).st_mtime_ns}
+        n_extracted += 1
+        if verbose and n_extracted % 500 == 0:
+            print(f"{n_extracted} files extracted ...")
+    return n_extracted
+
+
+def _manifest_covers(manifest: dict, target_dir: str, url: str, stimuli_only: bool, ids=None,
+                     conditions=None) -> bool:
+    """
+    Check if all requested members of the archive are already extracted, as listed in the manifest (the member
+    names of the archive are recorded there by download_study_data()).
+
+    :return: True if the archive does not need to be opened (or downloaded) at all
+    """
+    listing = manifest.get(MANIFEST_ARCHIVE)
+    if listing is None or listing["url"] != url or (not stimuli_only and "data_names" not in listing):
+        return False
+    names = list(listing["names"])
+    if not stimuli_only:
+        names += [name for name in listing["data_names"] if _is_data_member(name, ids, conditions)]
+
+    for name in names:
+        if name.endswith("/"):
+            continue  # directory
+        entry = manifest.get(name)
+        path = os.path.join(target_dir, *name.split("/"))
+        if entry is None or not os.path.isfile(path):
+            return False
+        stat = os.stat(path)
+        if entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            return False
+    return True
+
+
+def download_study_data(stimuli_only: bool, verbose: bool = True, ids=None, conditions=None,
+                        target_dir: str = ".", url: str = OSF_URL) -> None:
+    """
+    Download study data from OSF.
+
+    Only the requested members of the archive are extracted. If the server supports range requests, the archive
+    is read remotely and only the requested members are transferred. Otherwise (e.g., the generated zip archive of
+    OSF) the whole archive is downloaded to target_dir first ('osfstorage-archive.zip', interrupted downloads are
+    resumed), and removed after extraction. The nested data archive ('Data/Data.zip') is read from within the
+    archive.
+    Files already present (listed in the manifest '.gsp_manifest.json' or with matching checksum) are skipped,
+    so repeated or interrupted setups only extract missing files. If all requested files are present, the archive
+    is not opened (nor downloaded) at all; delete the manifest to check the archive on OSF again.
+
+    :param stimuli_only: True: extract stimuli only
+    :param verbose: print progress
+    :param ids: list of subject IDs to extract (also glob patterns, e.g., 'ID_5*'), None: all subjects
+    :param conditions: list of conditions to extract (e.g., ['Rise']), None: all conditions
+    :param target_dir: directory to extract data to
+    :param url: url (or local path) of the archive
+    """
+    import zipfile
+
+    manifest_path = os.path.join(target_dir, MANIFEST_NAME)
+    manifest = {}
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    if _manifest_covers(manifest, target_dir, url, stimuli_only, ids=ids, conditions=conditions):
         if verbose:
-            print(f"{data_dir} directory and it files removed.")
+            print(f"All requested files are already present in '{target_dir}' (see '{MANIFEST_NAME}').")
+        return
+
+    # Open archive
+    archive_path = os.path.join(target_dir, "osfstorage-archive.zip")
+    downloaded = False  # only an archive downloaded here is removed afterwards
+    if os.path.isfile(url):
+        archive = open(url, "rb")
     else:
-        # Unpack Data
-        path_to_data_zip = os.path.join(data_dir, data_dir+".zip")
-        with zipfile.ZipFile(path_to_data_zip, 'r') as zip_ref:
-            zip_ref.extractall()
-        # Remove zip file
-        os.remove(path_to_data_zip)
-
-    # Remove __MACOSX folder
-    shutil.rmtree("__MACOSX", ignore_errors=True)
+        archive = _HTTPRangeFile.open(url)
+        if archive is None:
+            if verbose:
+                print("Server does not support range requests, downloading the whole archive ...")
+            archive = open(_download_resume(url, filename=archive_path, verbose=verbose), "rb")
+            downloaded = True
+            if verbose:
+                print(f"Data downloaded to '{archive_path}'.")
+        elif verbose:
+            print("Reading data from OSF ...")
+
+    data_zip = "Data/Data.zip"
+    try:
+        with archive, zipfile.ZipFile(archive) as zip_ref:
+            # Stimuli (and further files), without data and __MACOSX folder
+            names = [name for name in zip_ref.namelist()
+                     if not name.startswith("__MACOSX") and not (name + "/").startswith("Data/")]
+            # Member names of the archive are recorded for repeated setups, see _manifest_covers()
+            listing = manifest.get(MANIFEST_ARCHIVE)
+            if listing is None or listing["url"] != url:
+                listing = {"url": url}
+            listing["names"] = names
+            n_extracted = _extract_members(zip_ref, names, target_dir, manifest, verbose=verbose)
+
+            # Unpack selected data
+            if not stimuli_only:
+                with _open_nested_zip(zip_ref, data_zip) as data_ref:
+                    data_names = [name for name in data_ref.namelist() if not name.startswith("__MACOSX")]
+                    names = [name for name in data_names if _is_data_member(name, ids, conditions)]
+                    n_extracted += _extract_members(data_ref, names, target_dir, manifest, verbose=verbose)
+                    listing["data_names"] = data_names
+            manifest[MANIFEST_ARCHIVE] = listing
+    finally:
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+
+    # Remove downloaded zip file
+    if downloaded:
+        os.remove(archive_path)
+    if verbose:
+        print(f"{n_extracted} files extracted to '{target_dir}' (files already present are skipped).")
 
     # Print files in data directory
     if verbose:
         if not stimuli_only:
             print(f"List dir: 'Data':")
-            print(os.listdir("Data"))
+            print(os.listdir(os.path.join(target_dir, "Data")))
         print(f"\nList dir: 'Stimuli':")
-        print(os.listdir("Stimuli"))
+        print(os.listdir(os.path.join(target_dir, "Stimuli")))
 
 
 def fixation_detection(x, y, time, max_dist: int = 25, min_dur: float = 0.25):
@@ -135,334 +443,1862 @@ def fixation_detection(x, y, time, max_dist: int = 25, min_dur: float = 0.25):
     return s_fix, e_fix
 
 
-def compute_df_e_fix(current_df: pd.DataFrame) -> pd.DataFrame:
-    x_i = current_df.iloc[:, 1].tolist()
-    y_j = current_df.iloc[:, 2].tolist()
-    time_t = current_df.iloc[:, 0].tolist()
-    y_j = [1024 - a for a in y_j]
+def _squared_threshold(max_dist: float) -> float:
+    """
+    Get the largest squared distance d2 for which sqrt(d2) <= max_dist.
+
+    Comparing squared distances against this value gives exactly the same decisions as comparing
+    Euclidean distances against max_dist, without taking a square root per sample.
+    """
+    if max_dist < 0:
+        return -1.0  # no distance is ever within a negative dispersion
+    thr = float(max_dist) ** 2
+    while np.sqrt(thr) > max_dist:
+        thr = np.nextafter(thr, -np.inf)
+    while np.sqrt(np.nextafter(thr, np.inf)) <= max_dist:
+        thr = np.nextafter(thr, np.inf)
+    return thr
+
+
+def _first_exceed(x: np.ndarray, y: np.ndarray, anchor: int, stop: int, thr: float, chunk: int = 64) -> int:
+    """
+    Find the first sample after anchor (and before stop) which is further away than the threshold.
+
+    The samples are scanned in growing chunks, hence long fixations need only a few numpy calls.
+    Returns stop if all samples stay within the threshold.
+    """
+    xa = float(x[anchor])
+    ya = float(y[anchor])
+    lo = anchor + 1
+    while lo < stop:
+        hi = min(stop, lo + chunk)
+        dx = x[lo:hi] - xa
+        dy = y[lo:hi] - ya
+        dx *= dx
+        dy *= dy
+        dx += dy  # squared distance
+        first = int((dx > thr).argmax())
+        if dx[first] > thr:
+            return lo + first
+        lo = hi
+        chunk *= 2
+    return stop
+
+
+def _fixation_candidates(x: np.ndarray, y: np.ndarray, offsets: np.ndarray, max_dist: float,
+                         step: np.ndarray = None):
+    """
+    Get start and end sample indices of all fixations in the segments offsets[i]:offsets[i+1], before the
+    minimal duration is applied (which does not change where fixations start and end).
+
+    Fixations never run across segment borders, i.e., each segment is processed as if it was passed
+    alone to fixation_detection().
+
+    :param step: squared distances between successive samples, can be shared by many max_dist values
+    """
+    thr = _squared_threshold(max_dist)
+    if step is None:
+        step = (x[1:] - x[:-1]) ** 2 + (y[1:] - y[:-1]) ** 2
+
+    # A fixation can only start at sample i if the previous sample (i-1) of the same segment is close enough
+    onsets = np.flatnonzero(step <= thr) + 1
+    onsets = onsets[~np.isin(onsets, offsets)]
+    stops = offsets[np.searchsorted(offsets, onsets, side='right')]
+
+    # Jump from fixation to fixation
+    onsets = onsets.tolist()
+    stops = stops.tolist()
+    s_idx = []
+    e_idx = []
+    k = 0
+    chunk = 64
+    while k < len(onsets):
+        si = onsets[k]
+        stop = stops[k]
+        ei = _first_exceed(x, y, anchor=si, stop=stop, thr=thr, chunk=chunk)
+        chunk = max(64, 2 * (ei - si))  # first guess for the length of the next fixation
+        if ei == stop:
+            # fixations which are still open at the end of a segment are not stored
+            k = bisect_left(onsets, stop, lo=k + 1)
+            continue
+        s_idx.append(si)
+        e_idx.append(ei - 1)
+        # After a fixation ends at sample ei, the next fixation can start at ei + 1 at the earliest
+        k = bisect_left(onsets, ei + 1, lo=k + 1)
+
+    return np.array(s_idx, dtype=np.intp), np.array(e_idx, dtype=np.intp)
+
+
+def _fixation_indices(x: np.ndarray, y: np.ndarray, time: np.ndarray, offsets: np.ndarray,
+                      max_dist: float, min_dur: float):
+    """Get start and end sample indices of all fixations in the segments offsets[i]:offsets[i+1]."""
+    s_idx, e_idx = _fixation_candidates(x, y, offsets, max_dist=max_dist)
+    keep = np.abs(time[e_idx] - time[s_idx]) >= min_dur  # only store fixations if the duration is ok
+    return s_idx[keep], e_idx[keep]
+
+
+def _as_gaze_arrays(x, y, time):
+    return np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(time, dtype=float)
+
+
+# Format of fixations returned by the array-native fixation engine (columns of _e_fix)
+FIXATION_DTYPE = np.dtype([('start', 'f8'), ('end', 'f8'), ('duration', 'f8'), ('x', 'f8'), ('y', 'f8')])
+SEGMENT_FIXATION_DTYPE = np.dtype([('segment', 'i8')] + FIXATION_DTYPE.descr)
+
+
+def fixation_detection_np(x, y, time, max_dist: float = 25, min_dur: float = 0.25) -> np.ndarray:
+    """
+    Get fixations with an array-native dispersion (I-DT) engine.
+
+    This gives exactly the fixations (e_fix) of fixation_detection(), but instead of visiting every
+    gaze sample in python, it loops once per fixation and scans the samples of each fixation with numpy.
+
+    :param x: x-coordinates of gaze samples
+    :param y: y-coordinates of gaze samples
+    :param time: time stamps of gaze samples
+    :param max_dist: maximal distance of samples to the start of the fixation
+    :param min_dur: minimal duration of a fixation
+    :return: structured array with the fields 'start', 'end', 'duration', 'x', 'y' (see FIXATION_DTYPE)
+    """
+    x, y, time = _as_gaze_arrays(x, y, time)
+    s_idx, e_idx = _fixation_indices(x, y, time, offsets=np.array([0, len(x)]),
+                                     max_dist=max_dist, min_dur=min_dur)
+
+    e_fix = np.empty(len(s_idx), dtype=FIXATION_DTYPE)
+    e_fix['start'] = time[s_idx]
+    e_fix['end'] = time[e_idx]
+    e_fix['duration'] = time[e_idx] - time[s_idx]
+    e_fix['x'] = x[s_idx]
+    e_fix['y'] = y[s_idx]
+    return e_fix
+
+
+def _as_offsets(offsets, n_samples: int) -> np.ndarray:
+    offsets = np.asarray(offsets, dtype=np.intp)
+    if offsets[0] != 0 or offsets[-1] != n_samples or np.any(np.diff(offsets) < 0):
+        raise ValueError("offsets must increase from 0 to the number of samples.")
+    return offsets
 
-    _s_fix, _e_fix = fixation_detection(x=x_i, y=y_j, time=time_t, max_dist=25, min_dur=0.25)
+
+def fixation_detection_segments(x, y, time, offsets, max_dist: float = 25, min_dur: float = 0.25) -> np.ndarray:
+    """
+    Get fixations for many segments (e.g., trials x phases x AOIs) of concatenated gaze data in one pass.
+
+    Segment i consists of the samples offsets[i]:offsets[i+1]. For every segment the result is the same
+    as running fixation_detection_np() on it alone.
+
+    :param x: x-coordinates of gaze samples of all segments
+    :param y: y-coordinates of gaze samples of all segments
+    :param time: time stamps of gaze samples of all segments
+    :param offsets: segment boundaries, starting with 0 and ending with the number of samples
+    :param max_dist: maximal distance of samples to the start of the fixation
+    :param min_dur: minimal duration of a fixation
+    :return: structured array with the fields 'segment', 'start', 'end', 'duration', 'x', 'y'
+    """
+    x, y, time = _as_gaze_arrays(x, y, time)
+    offsets = _as_offsets(offsets, n_samples=len(x))
+    s_idx, e_idx = _fixation_indices(x, y, time, offsets=offsets, max_dist=max_dist, min_dur=min_dur)
+
+    e_fix = np.empty(len(s_idx), dtype=SEGMENT_FIXATION_DTYPE)
+    e_fix['segment'] = np.searchsorted(offsets, s_idx, side='right') - 1
+    e_fix['start'] = time[s_idx]
+    e_fix['end'] = time[e_idx]
+    e_fix['duration'] = time[e_idx] - time[s_idx]
+    e_fix['x'] = x[s_idx]
+    e_fix['y'] = y[s_idx]
+    return e_fix
+
+
+def _fixation_candidates_ivt(x: np.ndarray, y: np.ndarray, time: np.ndarray, offsets: np.ndarray,
+                             max_velocity: float, max_dist: float, max_gap: float = FIXATION_MAX_GAP,
+                             window: float = FIXATION_VELOCITY_WINDOW):
+    """
+    Get start and end sample indices and centroids of all I-VT fixations in the segments offsets[i]:offsets[i+1],
+    before the minimal duration is applied.
+
+    Data blocks end at segment borders and at time gaps > max_gap. The velocity of each sample is the distance
+    between the samples about window/2 before and after it (within its block) divided by their time difference.
+    Runs of samples below max_velocity are fixations; successive fixations of a segment are merged if the
+    time between them is <= max_gap and their centroids are <= max_dist apart.
+    """
+    n = len(x)
+    if n == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0), np.empty(0)
+
+    # Blocks of continuous data
+    dt = np.diff(time)
+    new_block = np.zeros(n + 1, dtype=bool)
+    new_block[offsets] = True
+    new_block[1:n][dt > max_gap] = True
+    block_start = np.flatnonzero(new_block[:n])
+    block = np.cumsum(new_block[:n]) - 1
+    block_last = np.append(block_start[1:], n)[block] - 1
+
+    # Velocity of each sample over (about) the same time window at any sampling rate
+    positive = dt[dt > 0]
+    half = max(1, int(round(window / np.median(positive) / 2))) if len(positive) else 1
+    idx = np.arange(n)
+    lo = np.maximum(idx - half, block_start[block])
+    hi = np.minimum(idx + half, block_last)
+    dist = np.hypot(x[hi] - x[lo], y[hi] - y[lo])
+    is_fix = dist <= max_velocity * (time[hi] - time[lo])  # velocity <= max_velocity (no division by 0)
+
+    # Runs of fixation samples (run-length encoding), runs end at block borders
+    prev_fix = np.concatenate([[False], is_fix[:-1]]) & ~new_block[:n]
+    next_fix = np.concatenate([is_fix[1:], [False]]) & ~new_block[1:]
+    s_idx = np.flatnonzero(is_fix & ~prev_fix)
+    e_idx = np.flatnonzero(is_fix & ~next_fix)
+
+    # Merge successive fixations of the same segment which are close in time and space
+    fix_x = np.concatenate([[0.], np.cumsum(np.where(is_fix, x, 0.))])
+    fix_y = np.concatenate([[0.], np.cumsum(np.where(is_fix, y, 0.))])
+    fix_n = np.concatenate([[0], np.cumsum(is_fix)])
+    cx = (fix_x[e_idx + 1] - fix_x[s_idx]) / (fix_n[e_idx + 1] - fix_n[s_idx])
+    cy = (fix_y[e_idx + 1] - fix_y[s_idx]) / (fix_n[e_idx + 1] - fix_n[s_idx])
+    segment = np.searchsorted(offsets, s_idx, side='right') - 1
+    merge = ((segment[1:] == segment[:-1]) & (time[s_idx[1:]] - time[e_idx[:-1]] <= max_gap)
+             & (np.hypot(cx[1:] - cx[:-1], cy[1:] - cy[:-1]) <= max_dist))
+    s_idx = s_idx[np.concatenate([[True], ~merge])]
+    e_idx = e_idx[np.concatenate([~merge, [True]])]
+
+    n_fix = fix_n[e_idx + 1] - fix_n[s_idx]
+    return s_idx, e_idx, (fix_x[e_idx + 1] - fix_x[s_idx]) / n_fix, (fix_y[e_idx + 1] - fix_y[s_idx]) / n_fix
+
+
+def fixation_detection_ivt(x, y, time, offsets, max_velocity: float = FIXATION_MAX_VELOCITY,
+                           max_dist: float = 25, min_dur: float = 0.25, max_gap: float = FIXATION_MAX_GAP,
+                           window: float = FIXATION_VELOCITY_WINDOW) -> np.ndarray:
+    """
+    Get fixations for many segments of concatenated gaze data with a velocity threshold (I-VT) detector.
+
+    Alternative to the dispersion detector fixation_detection_segments() with the same output, all steps
+    (velocities, runs of fixation samples, merging, minimal duration) are array operations without python
+    loops over samples or fixations. The velocities are computed over a time window, hence the thresholds
+    mean the same at 120 Hz and at higher sampling rates. 'x', 'y' of a fixation are its centroid.
+
+    :param x: x-coordinates of gaze samples of all segments
+    :param y: y-coordinates of gaze samples of all segments
+    :param time: time stamps of gaze samples of all segments
+    :param offsets: segment boundaries, starting with 0 and ending with the number of samples
+    :param max_velocity: maximal velocity of fixation samples (in pixels per second)
+    :param max_dist: maximal distance of the centroids of successive fixations which are merged (in pixels)
+    :param min_dur: minimal duration of a fixation
+    :param max_gap: maximal time gap within a fixation and between successive fixations which are merged
+    :param window: time window of sample velocities (in seconds)
+    :return: structured array with the fields 'segment', 'start', 'end', 'duration', 'x', 'y'
+    """
+    x, y, time = _as_gaze_arrays(x, y, time)
+    offsets = _as_offsets(offsets, n_samples=len(x))
+    s_idx, e_idx, cx, cy = _fixation_candidates_ivt(x, y, time, offsets, max_velocity=max_velocity,
+                                                    max_dist=max_dist, max_gap=max_gap, window=window)
+    keep = time[e_idx] - time[s_idx] >= min_dur
+
+    e_fix = np.empty(np.count_nonzero(keep), dtype=SEGMENT_FIXATION_DTYPE)
+    e_fix['segment'] = np.searchsorted(offsets, s_idx[keep], side='right') - 1
+    e_fix['start'] = time[s_idx[keep]]
+    e_fix['end'] = time[e_idx[keep]]
+    e_fix['duration'] = time[e_idx[keep]] - time[s_idx[keep]]
+    e_fix['x'] = cx[keep]
+    e_fix['y'] = cy[keep]
+    return e_fix
+
+
+def _check_detector(detector: str) -> None:
+    if detector not in FIXATION_DETECTORS:
+        raise ValueError(f"Unknown fixation detector '{detector}', use one of {FIXATION_DETECTORS}.")
+
+
+def compute_df_e_fix(current_df: pd.DataFrame, max_dist: float = FIXATION_MAX_DIST,
+                     min_dur: float = FIXATION_MIN_DUR, flip_y: int = FLIP_Y, detector: str = FIXATION_DETECTOR,
+                     max_velocity: float = FIXATION_MAX_VELOCITY) -> pd.DataFrame:
+    _check_detector(detector)
+    x_i = current_df.iloc[:, 1].to_numpy(dtype=float)
+    y_j = current_df.iloc[:, 2].to_numpy(dtype=float)
+    time_t = current_df.iloc[:, 0].to_numpy(dtype=float)
+    if flip_y is not None:
+        y_j = flip_y - y_j
+
+    if detector == "ivt":
+        _e_fix = fixation_detection_ivt(x=x_i, y=y_j, time=time_t, offsets=[0, len(x_i)],
+                                        max_velocity=max_velocity, max_dist=max_dist, min_dur=min_dur)
+    else:
+        _e_fix = fixation_detection_np(x=x_i, y=y_j, time=time_t, max_dist=max_dist, min_dur=min_dur)
 
     # Write fixations in pandas dataframe with labels for columns
-    df_e_fix = pd.DataFrame(columns=['Start', 'End', 'Duration', 'X', 'Y'])
+    return fixations_to_df(_e_fix)
 
-    for ef in _e_fix:
-        ef_series = pd.Series(ef, index=df_e_fix.columns)
-        df_e_fix = pd.concat([df_e_fix, ef_series.to_frame().T], ignore_index=True)
 
-    return df_e_fix
+def fixations_to_df(e_fix) -> pd.DataFrame:
+    """
+    Write fixations in a pandas dataframe with the columns FIXATION_COLUMNS.
+
+    The columns are filled at once from the (preallocated) columns of e_fix, so the cost is linear in
+    the number of fixations. e_fix can be a structured array (see FIXATION_DTYPE) or the list of
+    fixations returned by fixation_detection().
+    """
+    if not isinstance(e_fix, np.ndarray):
+        e_fix = np.array([tuple(ef) for ef in e_fix], dtype=FIXATION_DTYPE)
+    return pd.DataFrame({col: e_fix[field] for col, field in zip(FIXATION_COLUMNS, FIXATION_DTYPE.names)})
 
 
-def compute_duration_rise(current_phase: str, fix_data_rise, trial_names) -> pd.DataFrame:
-    duration_rise = []
-    list_rise = []
-    for tr_name in trial_names:  # ~ trial_phase_data.keys():
-        df_duration_temp_ = fix_data_rise[tr_name][current_phase]["rise"].copy()
-        duration = df_duration_temp_['Duration'].sum()
-        _n = [tr_name, duration]
-        print(_n)
-        list_rise.append(_n)
-        duration_rise.append(duration)
+def concat_segments(segments: dict, names: list):
+    """
+    Concatenate the gaze data of many segments for a batched fixation detection.
 
-    print(duration_rise)
-    print(list_rise)
-    _df_rise = pd.DataFrame(list_rise, columns=['Trial', 'Duration_Rise'])
-    print(_df_rise)
+    :param segments: gaze data (DataFrames) keyed by tuples, e.g., (trial, phase, aoi)
+    :param names: column names for the elements of the key tuples
+    :return: concatenated gaze data, segment offsets, DataFrame with the keys of each segment
+    """
+    frames = list(segments.values())
+    offsets = np.concatenate([[0], np.cumsum([len(frame) for frame in frames])]).astype(np.intp)
+    if frames:
+        samples = pd.concat(frames, ignore_index=True)
+    else:
+        samples = pd.DataFrame(columns=['time', 'gaze_point_x', 'gaze_point_y'])
+    keys = pd.DataFrame(list(segments.keys()), columns=names)
+    return samples, offsets, keys
 
-    print(f"Baseline Sum Duration AOI Rise:", np.sum(duration_rise))
-    print(f"Baseline Mean Duration AOI Rise:", np.mean(duration_rise))
-    print(f"Baseline Std Duration AOI Rise:", np.std(duration_rise))
 
-    return _df_rise
+def _segment_gaze_arrays(samples: pd.DataFrame, flip_y: int = FLIP_Y):
+    x = samples['gaze_point_x'].to_numpy(dtype=float)
+    y = samples['gaze_point_y'].to_numpy(dtype=float)
+    if flip_y is not None:
+        y = flip_y - y
+    return x, y, samples['time'].to_numpy(dtype=float)
 
 
-def compute_duration_drop(current_phase: str, fix_data_drop, trial_names) -> pd.DataFrame:
-    # Dataframe with Sum of Duration in AOI-drop per Trial
-    duration_drop = []
-    list_drop = []
-    for tr_name in trial_names:  # ~ trial_phase_data.keys():
-        df_duration_temp = fix_data_drop[tr_name][current_phase]["drop"].copy()
-        duration = df_duration_temp['Duration'].sum()
-        _n = [tr_name, duration]
-        print(_n)
-        list_drop.append(_n)
-        duration_drop.append(duration)
+def compute_df_fix_segments(samples: pd.DataFrame, offsets, keys: pd.DataFrame,
+                            max_dist: float = FIXATION_MAX_DIST, min_dur: float = FIXATION_MIN_DUR,
+                            flip_y: int = FLIP_Y, detector: str = FIXATION_DETECTOR,
+                            max_velocity: float = FIXATION_MAX_VELOCITY) -> pd.DataFrame:
+    """
+    Batched version of compute_df_e_fix() for all segments of concatenated gaze data.
+
+    See concat_segments() to build samples, offsets and keys.
+
+    :param detector: fixation detector, 'idt' (see fixation_detection_segments()) or 'ivt' (with max_velocity,
+                     see fixation_detection_ivt())
+    :return: tidy table with the segment keys and the columns 'Start', 'End', 'Duration', 'X', 'Y'
+    """
+    _check_detector(detector)
+    x, y, time = _segment_gaze_arrays(samples, flip_y=flip_y)
+    if detector == "ivt":
+        _e_fix = fixation_detection_ivt(x=x, y=y, time=time, offsets=offsets, max_velocity=max_velocity,
+                                        max_dist=max_dist, min_dur=min_dur)
+    else:
+        _e_fix = fixation_detection_segments(x=x, y=y, time=time, offsets=offsets, max_dist=max_dist,
+                                             min_dur=min_dur)
+
+    return pd.concat([keys.iloc[_e_fix['segment']].reset_index(drop=True), fixations_to_df(_e_fix)], axis=1)
+
+
+def compute_df_fix_sweep(samples: pd.DataFrame, offsets, keys: pd.DataFrame, max_dists, min_durs,
+                         flip_y: int = FLIP_Y, detector: str = FIXATION_DETECTOR,
+                         max_velocity: float = FIXATION_MAX_VELOCITY) -> pd.DataFrame:
+    """
+    Fixations of all segments for every combination of max_dist and min_dur (parameter sweep).
+
+    The distances between successive samples are computed once and shared by all max_dist values.
+    Fixations are detected once per max_dist; min_dur only removes short fixations, so it is applied
+    afterwards to the durations of the detected fixations.
+
+    :param max_dists: list of dispersion thresholds (in pixels), for 'ivt': merge distances of fixations
+    :param min_durs: list of minimal fixation durations (in seconds)
+    :param detector: fixation detector, see compute_df_fix_segments()
+    :return: tidy table as of compute_df_fix_segments() with the leading columns 'Max_Dist', 'Min_Dur'
+    """
+    _check_detector(detector)
+    x, y, time = _segment_gaze_arrays(samples, flip_y=flip_y)
+    offsets = np.asarray(offsets, dtype=np.intp)
+    step = (x[1:] - x[:-1]) ** 2 + (y[1:] - y[:-1]) ** 2 if detector == "idt" else None
+
+    parts = []
+    for max_dist in max_dists:
+        if detector == "ivt":
+            s_idx, e_idx, fix_x, fix_y = _fixation_candidates_ivt(x, y, time, offsets, max_velocity=max_velocity,
+                                                                  max_dist=max_dist)
+        else:
+            s_idx, e_idx = _fixation_candidates(x, y, offsets, max_dist=max_dist, step=step)
+            fix_x, fix_y = x[s_idx], y[s_idx]
+        duration = time[e_idx] - time[s_idx]
+        for min_dur in min_durs:
+            keep = np.flatnonzero(np.abs(duration) >= min_dur)
+            df_part = keys.iloc[np.searchsorted(offsets, s_idx[keep], side='right') - 1].reset_index(drop=True)
+            df_part.insert(0, 'Min_Dur', min_dur)
+            df_part.insert(0, 'Max_Dist', max_dist)
+            df_part['Start'] = time[s_idx[keep]]
+            df_part['End'] = time[e_idx[keep]]
+            df_part['Duration'] = duration[keep]
+            df_part['X'] = fix_x[keep]
+            df_part['Y'] = fix_y[keep]
+            parts.append(df_part)
+
+    if not parts:
+        return pd.DataFrame(columns=['Max_Dist', 'Min_Dur'] + list(keys.columns) + FIXATION_COLUMNS)
+    return pd.concat(parts, ignore_index=True)
+
+
+def compute_dls(df_fix: pd.DataFrame, by: list, groups: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    Compute the duration of fixations in AOI rise and drop, their sum and the DLS per group.
+
+    DLS = (Duration_Rise - Duration_Drop) / Duration_Sum
+
+    :param df_fix: long fixation table with the column 'AOI' (see compute_df_fix_segments())
+    :param by: columns to group by (e.g., ['Trial', 'Phase'])
+    :param groups: all groups (columns by) to report, also those without fixations, None: groups in df_fix
+    :return: table with the columns by and 'Duration_Rise', 'Duration_Drop', 'Duration_Sum', 'DLS'
+    """
+    df_fix = df_fix[df_fix['AOI'].isin(['rise', 'drop'])]
+    durations = df_fix.groupby(by + ['AOI'], sort=False)['Duration'].sum().unstack('AOI')
+    durations = durations.reindex(columns=['rise', 'drop']).fillna(0.)
+    if groups is not None:
+        durations = durations.reindex(pd.MultiIndex.from_frame(groups[by]) if len(by) > 1 else groups[by[0]],
+                                      fill_value=0.)
+
+    df_dls = pd.DataFrame({'Duration_Rise': durations['rise'], 'Duration_Drop': durations['drop']})
+    df_dls['Duration_Sum'] = df_dls['Duration_Rise'] + df_dls['Duration_Drop']
+    df_dls['DLS'] = (df_dls['Duration_Rise'] - df_dls['Duration_Drop']) / df_dls['Duration_Sum']
+    return df_dls.reset_index()
+
+
+def summarize_dls(df_dls: pd.DataFrame, by: list) -> pd.DataFrame:
+    """
+    Compute mean and standard deviation (as np.std, i.e., ddof=0) of durations and DLS per group.
+
+    E.g., per subject: by=['ID', 'Condition', 'Phase'], for the cohort: by=['Condition', 'Phase'].
+    Trials without fixations in AOI rise and drop (DLS is NaN) are left out of the DLS statistics.
+
+    :param df_dls: table of compute_dls() with one row per trial
+    :param by: columns to group by
+    :return: table with the columns by, 'N_Trials' and '<column>_Mean', '<column>_Std' per duration and DLS
+    """
+    columns = ['Duration_Rise', 'Duration_Drop', 'Duration_Sum', 'DLS']
+    grouped = df_dls.groupby(by, sort=False)[columns]
+    df_mean = grouped.mean()
+    df_std = grouped.std(ddof=0)
+    df_summary = pd.DataFrame({'N_Trials': grouped.size()})
+    for column in columns:
+        df_summary[f"{column}_Mean"] = df_mean[column]
+        df_summary[f"{column}_Std"] = df_std[column]
+    return df_summary.reset_index()
+
+
+def split_segments(df_fix: pd.DataFrame, keys: pd.DataFrame) -> dict:
+    """Split a table of compute_df_fix_segments() into one DataFrame (as of compute_df_e_fix) per key."""
+    names = list(keys.columns)
+    groups = {key: group.drop(columns=names).reset_index(drop=True)
+              for key, group in df_fix.groupby(names, sort=False)}
+    return {key: groups[key] if key in groups else fixations_to_df([])
+            for key in keys.itertuples(index=False, name=None)}
+
+
+# Columns of trial csv files needed for processing, and their format in the cache
+TRIAL_COLUMNS = ['time', 'gaze_point_x', 'gaze_point_y']
+# Dimensions of the tuple fields of 'global' Tobii files by suffix of their name (see parse_global_gaze_chunk())
+TUPLE_FIELD_DIMS = {'on_display_area': 2, 'in_user_coordinate_system': 3, 'in_trackbox_coordinate_system': 3}
+
+
+def _cache_stem(csv_path: str) -> str:
+    """Get the part of the cache file name which identifies the csv file (independent of its version)."""
+    import hashlib
+
+    return hashlib.sha1(os.path.abspath(csv_path).encode("utf-8")).hexdigest()
+
+
+def load_trial(csv_path: str, use_cache: bool = True, cache_dir: str = CACHE_PATH,
+               gaze_dtype: str = 'f8') -> pd.DataFrame:
+    """
+    Load the gaze data of one trial from its csv file, using a binary cache.
+
+    The columns TRIAL_COLUMNS are parsed once and stored as .npy file in cache_dir. The cache entry is
+    keyed by the path, size and modification time of the csv file, hence changed files are parsed again.
+    See clear_trial_cache() to invalidate entries explicitly.
+
+    :param csv_path: path to trial csv file
+    :param use_cache: False: parse csv file without reading/writing the cache
+    :param cache_dir: path to cache directory
+    :param gaze_dtype: dtype of gaze coordinates in cache, 'f8' keeps results identical to parsing the csv,
+                       'f4' halves the size of the cache
+    :return: gaze data with the columns TRIAL_COLUMNS
+    """
+    if not use_cache:
+        return pd.read_csv(csv_path, usecols=TRIAL_COLUMNS)[TRIAL_COLUMNS]
+
+    stat = os.stat(csv_path)
+    stem = _cache_stem(csv_path)
+    cache_file = os.path.join(cache_dir, f"{stem}_{stat.st_size}_{stat.st_mtime_ns}_{gaze_dtype}.npy")
+
+    if os.path.isfile(cache_file):
+        data = np.load(cache_file, mmap_mode='r')
+    else:
+        df_trial = pd.read_csv(csv_path, usecols=TRIAL_COLUMNS)
+        data = np.empty(len(df_trial), dtype=[('time', 'f8'), ('gaze_point_x', gaze_dtype),
+                                              ('gaze_point_y', gaze_dtype)])
+        for col in TRIAL_COLUMNS:
+            data[col] = df_trial[col].to_numpy(dtype=float)
+
+        # Remove outdated versions of this file from cache and write new entry atomically
+        clear_trial_cache(csv_path, cache_dir=cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = cache_file + f".{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.save(f, data)
+        os.replace(tmp_file, cache_file)
+
+    return pd.DataFrame({col: np.asarray(data[col], dtype=float) for col in TRIAL_COLUMNS})
+
+
+def clear_trial_cache(csv_path: str = None, cache_dir: str = CACHE_PATH) -> int:
+    """
+    Remove entries from the binary cache of trial csv files.
+
+    :param csv_path: remove only the entries of this csv file (None: clear whole cache)
+    :param cache_dir: path to cache directory
+    :return: number of removed cache files
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    prefix = _cache_stem(csv_path) + "_" if csv_path is not None else ""
+    n_removed = 0
+    for fn in os.listdir(cache_dir):
+        if fn.startswith(prefix) and fn.endswith(".npy"):
+            os.remove(os.path.join(cache_dir, fn))
+            n_removed += 1
+    return n_removed
+
+
+def _split_tuple_column(values: pd.Series, n_dim: int = None) -> np.ndarray:
+    """
+    Parse a column of stringified tuples, e.g., '(0.51, 0.48)', into a 2D float array.
+
+    All strings of the column are parsed by numpy in one go instead of one ast.literal_eval() per cell.
+
+    :param values: column of stringified tuples (missing values: NaN)
+    :param n_dim: number of dimensions of the tuples, None: inferred from the first tuple of the column
+    :return: array of shape (len(values), n_dim), NaN for missing values
+    """
+    first = values.dropna()
+    if first.empty:
+        return np.full((len(values), n_dim or 1), np.nan)
+    if n_dim is None:
+        n_dim = str(first.iloc[0]).count(",") + 1
+    strings = values.fillna("(" + ", ".join(["nan"] * n_dim) + ")").astype(str)
+    text = ",".join(strings).replace("(", "").replace(")", "")
+    try:
+        parsed = np.fromstring(text, sep=",")
+    except ValueError:
+        parsed = np.empty(0)
+    if parsed.size != len(values) * n_dim:
+        # Fallback for irregular cells (e.g., missing values written as empty tuple)
+        parts = strings.str.strip("()").str.split(",", expand=True).reindex(columns=range(n_dim))
+        return parts.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    return parsed.reshape(len(values), n_dim)
+
+
+def parse_global_gaze_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert a chunk of a 'global' Tobii dump file into typed numeric columns.
 
-    print(duration_drop)
-    print(list_drop)
-    _df_drop = pd.DataFrame(list_drop, columns=['Trial', 'Duration_Drop'])
-    print(_df_drop)
+    Tuple columns are split into one column per dimension, e.g., 'left_gaze_point_on_display_area' into
+    'left_gaze_point_on_display_area_x' and 'left_gaze_point_on_display_area_y'. Validity codes become nullable
+    Int8, time stamps nullable Int64, and all other values float.
 
-    print(f"Baseline Sum Duration per Trial AOI Drop:", np.sum(duration_drop))
-    print(f"Baseline Mean Duration AOI Drop:", np.mean(duration_drop))
-    print(f"Baseline Std Duration AOI Drop:", np.std(duration_drop))
+    All chunks of a file have the same columns and types: the Tobii tuple fields (see TUPLE_FIELD_DIMS) are split
+    also if a chunk has no values (e.g., track loss), and missing validity codes and time stamps are <NA>.
+    """
+    columns = {}
+    for col in chunk.columns:
+        values = chunk[col]
+        n_dim = next((dims for suffix, dims in TUPLE_FIELD_DIMS.items() if col.endswith(suffix)), None)
+        if n_dim is not None or (not pd.api.types.is_numeric_dtype(values)
+                                 and values.dropna().astype(str).str.startswith("(").all()):
+            parsed = _split_tuple_column(values, n_dim=n_dim)
+            for i_dim in range(parsed.shape[1]):
+                columns[f"{col}_{'xyz'[i_dim] if parsed.shape[1] <= 3 else i_dim}"] = parsed[:, i_dim]
+        elif col.endswith("validity"):
+            columns[col] = pd.to_numeric(values, errors='coerce').astype("Int8").array
+        elif col.endswith("time_stamp"):
+            columns[col] = pd.to_numeric(values, errors='coerce').astype("Int64").array
+        else:
+            columns[col] = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+    return pd.DataFrame(columns, index=chunk.index)
+
+
+def iter_global_gaze_data(csv_path: str, chunksize: int = 50_000, columns: list = None):
+    """
+    Stream a 'global' Tobii dump file (see App.write_data()) as batches of typed records.
+
+    Only one chunk of the file is held in memory at a time.
+
+    :param csv_path: path to global csv file
+    :param chunksize: number of samples per batch
+    :param columns: columns of the csv file to read (None: all), e.g., ['device_time_stamp', 'left_pupil_diameter']
+    :return: iterator over DataFrames (see parse_global_gaze_chunk())
+    """
+    for chunk in pd.read_csv(csv_path, chunksize=chunksize, usecols=columns):
+        yield parse_global_gaze_chunk(chunk)
+
+
+def phase_index(time) -> dict:
+    """
+    Get the boundaries of the PHASES (baseline/contingent/disruption) of a trial.
+
+    The boundaries are searched once in the sorted time stamps and given as start/stop offsets,
+    i.e., the data of a phase is trial_data.iloc[start:stop] (a view, not a copy).
+
+    :param time: sorted time stamps of the whole trial (in seconds)
+    :return: {phase: (start, stop)}
+    """
+    time = np.asarray(time, dtype=float)
+    n = len(time)
+    if n == 0:
+        return {phase: (0, 0) for phase in PHASES}
+
+    # Baseline: 4 < time < 9
+    b_start = int(np.searchsorted(time, 4, side='right'))
+    b_stop = max(b_start, int(np.searchsorted(time, 9, side='left')))
+    # Disruption: last 5 seconds of trial
+    d_start = int(np.searchsorted(time, time[-1] - 5, side='right'))
+    # Contingent: everything in between
+    c_start = int(np.searchsorted(time, time[b_stop - 1], side='right')) if b_stop > b_start else b_stop
+    c_stop = int(np.searchsorted(time, time[d_start], side='left')) if d_start < n else d_start
+    c_stop = max(c_start, c_stop)
+
+    return {'baseline': (b_start, b_stop), 'contingent': (c_start, c_stop), 'disruption': (d_start, n)}
+
+
+def resample_trial(trial_data: pd.DataFrame, rate: float = RESAMPLE_RATE,
+                   max_gap: float = RESAMPLE_MAX_GAP) -> pd.DataFrame:
+    """
+    Resample the gaze data of a trial onto a uniform time grid.
+
+    The grid has a fixed step of 1/rate seconds from the first sample on and covers the recorded parts of the
+    trial only (no grid points where the eye tracker did not record for more than max_gap, e.g., during the
+    transition video). Gaze coordinates are interpolated linearly between the valid samples around each grid
+    point if they are at most max_gap apart; grid points in longer gaps of valid data (track loss) are NaN.
+
+    :param trial_data: sorted gaze data with the columns TRIAL_COLUMNS
+    :param rate: rate of time grid (in Hz)
+    :param max_gap: longest gap of valid data which is interpolated (in seconds)
+    :return: gaze data with the columns TRIAL_COLUMNS on the time grid
+    """
+    time = trial_data['time'].to_numpy(dtype=float)
+    x = trial_data['gaze_point_x'].to_numpy(dtype=float)
+    y = trial_data['gaze_point_y'].to_numpy(dtype=float)
+    if len(time) == 0:
+        return pd.DataFrame({col: np.empty(0) for col in TRIAL_COLUMNS})
+
+    # Grid points within the recorded blocks of the trial
+    new_block = np.flatnonzero(np.diff(time) > max_gap) + 1
+    block_start = time[np.concatenate([[0], new_block])]
+    block_end = time[np.concatenate([new_block - 1, [len(time) - 1]])]
+    grid = time[0] + np.arange(int(np.floor((time[-1] - time[0]) * rate)) + 1) / rate
+    grid = grid[grid <= block_end[np.searchsorted(block_start, grid, side='right') - 1]]
+
+    # Valid samples before and after each grid point
+    valid = ~(np.isnan(x) | np.isnan(y))
+    t_valid = time[valid]
+    if len(t_valid) == 0:
+        return pd.DataFrame({'time': grid, 'gaze_point_x': np.nan, 'gaze_point_y': np.nan})
+    after = np.searchsorted(t_valid, grid, side='left')
+    t_after = t_valid[np.minimum(after, len(t_valid) - 1)]
+    t_before = t_valid[np.maximum(after - 1, 0)]
+    inside = (after > 0) & (after < len(t_valid)) & (t_after - t_before <= max_gap)
+    exact = (after < len(t_valid)) & (t_after == grid)
+    keep = inside | exact
+
+    return pd.DataFrame({'time': grid,
+                         'gaze_point_x': np.where(keep, np.interp(grid, t_valid, x[valid]), np.nan),
+                         'gaze_point_y': np.where(keep, np.interp(grid, t_valid, y[valid]), np.nan)})
+
+
+def trial_quality(time, valid, phase_bounds: dict, min_valid: dict = None) -> pd.DataFrame:
+    """
+    Data quality of one trial per phase, computed from the time stamps and the valid-sample mask in one pass.
+
+    The valid duration of a phase is the number of valid samples times the sample interval of the trial (median
+    time difference of successive samples), the effective sampling rate is the number of valid samples per
+    second of the phase. The longest gap is the longest time without a valid sample (including the borders of
+    the phase). A phase passes if its valid duration reaches the inclusion criterion (see QC_MIN_VALID).
+
+    :param time: sorted time stamps of the whole trial (in seconds)
+    :param valid: True for samples with valid gaze data (no NaN)
+    :param phase_bounds: {phase: (start, stop)} in the whole trial, see phase_index()
+    :param min_valid: minimal valid duration per phase (in seconds), None: QC_MIN_VALID
+    :return: table with the columns QC_COLUMNS, one row per phase
+    """
+    min_valid = QC_MIN_VALID if min_valid is None else min_valid
+    time = np.asarray(time, dtype=float)
+    valid = np.asarray(valid, dtype=bool)
+    dt = np.diff(time)
+    dt = dt[dt > 0]
+    interval = float(np.median(dt)) if len(dt) else np.nan
+
+    # Number of valid samples before each sample, and the time stamps of valid samples
+    n_valid = np.concatenate([[0], np.cumsum(valid)])
+    valid_time = time[valid]
+
+    rows = []
+    for phase in PHASES:
+        start, stop = phase_bounds[phase]
+        n_phase = stop - start
+        v_start, v_stop = int(n_valid[start]), int(n_valid[stop])
+        duration = time[stop - 1] - time[start] if n_phase else 0.
+        if v_stop > v_start:
+            edges = np.concatenate([[time[start]], valid_time[v_start:v_stop], [time[stop - 1]]])
+            longest_gap = float(np.diff(edges).max())
+        else:
+            longest_gap = duration
+        valid_duration = (v_stop - v_start) * interval
+        rows.append([phase, n_phase, v_stop - v_start, 1 - (v_stop - v_start) / n_phase if n_phase else 1.,
+                     duration, valid_duration, longest_gap, (v_stop - v_start) / duration if duration > 0 else 0.,
+                     bool(valid_duration >= min_valid[phase])])
+    return pd.DataFrame(rows, columns=QC_COLUMNS)
+
+
+def _is_rectangle(shape) -> bool:
+    return len(shape) == 4 and all(np.isscalar(v) for v in shape)
+
+
+def _scale_aoi_definition(aoi_definition: dict, screen_size: tuple) -> dict:
+    """Scale AOI definition from AOI_SCREEN_SIZE to the given screen size."""
+    sx = screen_size[0] / AOI_SCREEN_SIZE[0]
+    sy = screen_size[1] / AOI_SCREEN_SIZE[1]
+    if sx == 1 and sy == 1:
+        return aoi_definition
+    return {name: [(shape[0] * sx, shape[1] * sy, shape[2] * sx, shape[3] * sy) if _is_rectangle(shape)
+                   else [(px * sx, py * sy) for px, py in shape] for shape in shapes]
+            for name, shapes in aoi_definition.items()}
+
+
+def _points_in_polygon(x: np.ndarray, y: np.ndarray, polygon) -> np.ndarray:
+    """Check which points lie inside a polygon (even-odd rule, vectorized over points)."""
+    inside = np.zeros(len(x), dtype=bool)
+    px, py = np.asarray(polygon, dtype=float).T
+    for x1, y1, x2, y2 in zip(px, py, np.roll(px, -1), np.roll(py, -1)):
+        crosses = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (x < x_cross)
+    return inside
+
+
+def label_aoi(x, y, aoi_definition: dict, screen_size: tuple = AOI_SCREEN_SIZE) -> np.ndarray:
+    """
+    Label every gaze sample with the code of its area of interest (AOI).
 
-    return _df_drop
+    All rectangles of all AOIs are resolved in one pass: x and y are located in the grid spanned by the
+    rectangle borders, and each grid cell (or border) is looked up in a small precomputed table of codes.
+    Adding an AOI therefore does not add a pass over the samples (polygons are tested separately).
 
+    :param x: x-coordinates of gaze samples (screen pixels)
+    :param y: y-coordinates of gaze samples (screen pixels)
+    :param aoi_definition: {aoi name: [rectangles and/or polygons]}, see AOI_DEFINITIONS
+    :param screen_size: screen size (width, height) of the gaze data
+    :return: int8 array, 0: no AOI, i: i-th AOI of aoi_definition (first match if AOIs overlap)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    aoi_definition = _scale_aoi_definition(aoi_definition, screen_size)
+    rectangles = [(code, shape) for code, shapes in enumerate(aoi_definition.values(), start=1)
+                  for shape in shapes if _is_rectangle(shape)]
+    labels = np.zeros(len(x), dtype=np.int8)
+
+    if rectangles:
+        # Grid of all rectangle borders; cell code l + r is even inside an interval and odd on a border
+        x_edges = np.unique([v for _, rect in rectangles for v in (rect[0], rect[2]) if np.isfinite(v)])
+        y_edges = np.unique([v for _, rect in rectangles for v in (rect[1], rect[3]) if np.isfinite(v)])
+
+        def _cell_codes(v, edges):
+            return np.searchsorted(edges, v, side='left') + np.searchsorted(edges, v, side='right')
+
+        def _cell_centers(edges):
+            bounds = np.concatenate([[edges[0] - 1], edges, [edges[-1] + 1]]) if len(edges) else np.zeros(2)
+            centers = np.empty(2 * len(edges) + 1)
+            centers[0::2] = (bounds[:-1] + bounds[1:]) / 2  # inside intervals
+            centers[1::2] = edges  # on borders
+            return centers
+
+        # Table of codes for all cells (first matching AOI wins)
+        cx, cy = np.meshgrid(_cell_centers(x_edges), _cell_centers(y_edges), indexing='ij')
+        table = np.zeros(cx.shape, dtype=np.int8)
+        for code, (x_min, y_min, x_max, y_max) in rectangles:
+            inside = (cx > x_min) & (cx < x_max) & (cy > y_min) & (cy < y_max)
+            table[inside & (table == 0)] = code
+
+        valid = ~(np.isnan(x) | np.isnan(y))
+        labels[valid] = table[_cell_codes(x[valid], x_edges), _cell_codes(y[valid], y_edges)]
+
+    for code, shapes in enumerate(aoi_definition.values(), start=1):
+        for shape in shapes:
+            if not _is_rectangle(shape):
+                inside = _points_in_polygon(x, y, shape)
+                labels[inside & ((labels == 0) | (labels > code))] = code
+
+    return labels
+
+
+def group_by_aoi(labels: np.ndarray, n_aoi: int):
+    """
+    Group samples by AOI label, keeping the time order within each AOI.
 
-def add_drop_and_save(current_df_rise: pd.DataFrame, current_df_drop: pd.DataFrame,
-                      condition: str, save_dir: str) -> None:
-    current_df_rise['Duration_Drop'] = current_df_drop['Duration_Drop']
-    current_df_rise['Duration_Sum'] = current_df_rise['Duration_Rise'] + current_df_rise['Duration_Drop']
-    current_df_rise['DLS'] = (current_df_rise['Duration_Rise'] -
-                              current_df_rise['Duration_Drop']) / current_df_rise['Duration_Sum']
-    current_df_rise['Condition'] = condition
-    print(current_df_rise)
+    :return: order, offsets: samples of AOI code i are order[offsets[i]:offsets[i+1]] (i=0: no AOI)
+    """
+    order = np.argsort(labels, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_aoi + 1))])
+    return order, offsets
 
-    # Save to csv
-    current_df_rise.to_csv(os.path.join(
-        save_dir, f"DUR_{FLAGS.id}_{condition}_Baseline.csv"), sep=",")
 
+def aoi_dwell(labels: np.ndarray, time, n_aoi: int):
+    """
+    Get number of samples and dwell time per AOI label with one group-by over the labels.
+
+    Each sample counts with the interval to the next sample, but at most with the median sampling interval,
+    hence track loss does not add to the dwell time.
+
+    :return: n_samples, dwell: arrays indexed by AOI code (0: no AOI)
+    """
+    time = np.asarray(time, dtype=float)
+    dt = np.diff(time)
+    if len(dt):
+        dt = np.append(np.minimum(dt, np.median(dt)), np.median(dt))
+    else:
+        dt = np.zeros(len(time))
+    n_samples = np.bincount(labels, minlength=n_aoi + 1)
+    dwell = np.bincount(labels, weights=dt, minlength=n_aoi + 1)
+    return n_samples, dwell
+
+
+def heatmap_shape(tile: int = HEATMAP_TILE, screen_size: tuple = AOI_SCREEN_SIZE) -> tuple:
+    """Get number of rows and columns of the tile grid (as the blocks of App.fill_image(), last ones are cut)."""
+    return -(-screen_size[1] // tile), -(-screen_size[0] // tile)
+
+
+def bin_heatmaps(x, y, segment, n_segments: int, weights=None, tile: int = HEATMAP_TILE,
+                 screen_size: tuple = AOI_SCREEN_SIZE) -> np.ndarray:
+    """
+    Bin the gaze points of many segments (e.g., trials x phases x AOIs) into tile grids in one histogram pass.
+
+    Points are assigned to tiles as in App.update_clock() (x - x % tile, y - y % tile, screen coordinates),
+    points off the screen and NaN values are ignored.
+
+    :param x: x-coordinates of gaze points (in pixels)
+    :param y: y-coordinates of gaze points (in pixels, origin: top left corner of the screen)
+    :param segment: segment index of each gaze point
+    :param n_segments: number of segments
+    :param weights: weight of each gaze point (e.g., fixation duration), None: count gaze points
+    :param tile: size of tiles in pixels
+    :param screen_size: width, height of screen in pixels
+    :return: array of shape (n_segments, rows, columns) (see heatmap_shape())
+    """
+    n_rows, n_cols = heatmap_shape(tile, screen_size)
+    col = np.floor(np.asarray(x, dtype=float) / tile)
+    row = np.floor(np.asarray(y, dtype=float) / tile)
+    valid = (col >= 0) & (col < n_cols) & (row >= 0) & (row < n_rows)
+    cell = (np.asarray(segment, dtype=np.intp)[valid] * n_rows + row[valid].astype(np.intp)) * n_cols \
+        + col[valid].astype(np.intp)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)[valid]
+    grids = np.bincount(cell, weights=weights, minlength=n_segments * n_rows * n_cols)
+    return grids.astype(float).reshape(n_segments, n_rows, n_cols)
+
+
+def write_heatmaps(path: str, keys: pd.DataFrame, grids: dict, tile: int = HEATMAP_TILE) -> None:
+    """
+    Save heatmaps (e.g., per trial, phase and AOI) in one .npz file.
 
-def df_fix_to_csv(current_phase: str, fix_data, trial_names):
+    :param path: path of heatmap file
+    :param keys: keys of heatmaps (one row per heatmap, e.g., columns 'ID', 'Condition', 'Trial', 'Phase', 'AOI')
+    :param grids: dict of name and array of heatmaps (keys x rows x columns), e.g., {"gaze": ..., "fixation": ...}
+    :param tile: size of tiles in pixels
+    """
+    arrays = {f"key/{column}": keys[column].to_numpy().astype(str) for column in keys.columns}
+    arrays.update({f"grid/{name}": grid for name, grid in grids.items()})
+    path_tmp = path + ".tmp.npz"
+    np.savez(path_tmp, tile=tile, **arrays)
+    os.replace(path_tmp, path)
+
+
+def read_heatmaps(path: str):
+    """
+    Read heatmaps written by write_heatmaps().
+
+    :return: keys, dict of name and array of heatmaps, size of tiles
+    """
+    with np.load(path) as heatmaps:
+        keys = pd.DataFrame({name[len("key/"):]: heatmaps[name]
+                             for name in heatmaps.files if name.startswith("key/")})
+        grids = {name[len("grid/"):]: heatmaps[name] for name in heatmaps.files if name.startswith("grid/")}
+        return keys, grids, int(heatmaps["tile"])
+
+
+def sum_heatmaps(paths, by: list = None):
+    """
+    Sum saved heatmaps per group, e.g., cohort heatmaps from the per-trial heatmaps of all participants.
+
+    The heatmap files are read one after another and added up (no gaze data is binned again).
+
+    :param paths: paths of heatmap files (see write_heatmaps())
+    :param by: key columns to group by, None: ['Condition', 'Phase', 'AOI']
+    :return: keys, dict of name and array of summed heatmaps, size of tiles
+    """
+    by = ['Condition', 'Phase', 'AOI'] if by is None else by
+    totals = {}
+    tile = None
+    for path in paths:
+        keys, grids, file_tile = read_heatmaps(path)
+        if tile is not None and file_tile != tile:
+            raise ValueError(f"Heatmaps in '{path}' have tiles of {file_tile} pixels, expected {tile} pixels.")
+        tile = file_tile
+        for group, index in keys.groupby(by, sort=False).indices.items():
+            group_totals = totals.setdefault(group if isinstance(group, tuple) else (group,), {})
+            for name, grid in grids.items():
+                group_totals[name] = group_totals.get(name, 0.) + grid[index].sum(axis=0)
+
+    keys = pd.DataFrame(list(totals), columns=by)
+    names = list(next(iter(totals.values()))) if totals else []
+    return keys, {name: np.stack([group_totals[name] for group_totals in totals.values()]) for name in names}, tile
+
+
+def df_fix_to_csv(current_phase: str, fix_data, trial_names, subject_id: str, condition: str, save_dir: str):
     """Saves Fixation Data to csv files per child, trial and phase"""
     for tr_name in trial_names:  # ~ trial_phase_data.keys():
-        _df_fix = pd.DataFrame(columns=['Start', 'End', 'Duration', 'X', 'Y', 'Trial'])
-        _df_fix_temp = fix_data[tr_name][current_phase].copy()
-        _df_fix = pd.concat([_df_fix, _df_fix_temp], ignore_index=True)
+        _df_fix = fix_data[tr_name][current_phase].reindex(columns=FIXATION_COLUMNS)
         _df_fix['Trial'] = tr_name
         if len(_df_fix) != 0:
             _df_fix.to_csv(os.path.join(
-                SAVE_PATH_FIXATION_OVERALL,
-                f"{current_phase}_fixation_{FLAGS.id}_{FLAGS.condition}_{tr_name}.csv"), sep=",")
+                save_dir, f"{current_phase}_fixation_{subject_id}_{condition}_{tr_name}.csv"), sep=",")
 
 
-def main():
+def _table_arrays(name: str, df: pd.DataFrame) -> dict:
+    """Get the columns of a table as arrays '<name>/<column>', text columns as fixed-width strings."""
+    arrays = {}
+    for column in df.columns:
+        values = df[column].to_numpy()
+        if not np.issubdtype(values.dtype, np.number) and not np.issubdtype(values.dtype, np.bool_):
+            values = values.astype(str)
+        arrays[f"{name}/{column}"] = values
+    return arrays
 
-    # Set paths
-    subject_data_path = os.path.join(DATA_ROOT_PATH, ID, CONDITION.lower())
-    files_gsp = os.listdir(subject_data_path)
-    trial_names = sorted([trial_fn.split("_")[0] for trial_fn in files_gsp])
 
-    # Load csv files for one participant and define names for trials and PHASES.
-    # So far you can only process one participant in one condition of the gaze scratch paradigm at a time
-    print("Trial names:\n", trial_names)
+def write_dataset(path: str, tables: dict, keys=DATASET_KEYS) -> None:
+    """
+    Write output tables of a run in bulk into one columnar dataset file (uncompressed .npz).
 
-    # Split Raw Data into trials and PHASES and write in nested dictionary
-    trial_phase_data = {}
-    for trial_name in trial_names:
-        # Read whole trial data
-        trial_data = pd.read_csv(os.path.join(subject_data_path, trial_name))
-
-        # Divide data into the three PHASES (baseline/contingent/disruption) of the experiment
-        # make sure the timing is correct and matches you trial design
-        trial_data_baseline = trial_data.loc[(trial_data['time'] > 4) & (
-                trial_data['time'] < 9)].reset_index(drop=True)
-        trial_data_disruption = trial_data.loc[(
-                trial_data['time'] > trial_data['time'].iloc[-1] - 5)].reset_index(drop=True)
-        trial_data_contingent = trial_data.loc[
-            (trial_data['time'] > trial_data_baseline['time'].iloc[-1]) & (
-                    trial_data['time'] < trial_data_disruption['time'].iloc[0])].reset_index(drop=True)
-
-        # Fill in data dict per trial
-        trial_dict = {trial_name: {}}
-        trial_phase_data.update(trial_dict)  # nested dict
-        trial_phase_data[trial_name].update(dict(baseline=trial_data_baseline))
-        trial_phase_data[trial_name].update(dict(disruption=trial_data_disruption))
-        trial_phase_data[trial_name].update(dict(contingent=trial_data_contingent))
-
-    # Clean Data per Trial and Phase (drop 'nan' values)
-    for trial_name in trial_names:  # ~ trial_phase_data.keys():
-        for phase in PHASES:
-            trial_phase_data[trial_name][phase].dropna(inplace=True)
-            trial_phase_data[trial_name][phase].reset_index(inplace=True, drop=True)
+    Every column is stored as an array '<table>/<column>' and the rows are sorted by the partition keys
+    (e.g., ID/Condition/Phase/Trial), so each partition is a contiguous block of rows. The key values and first
+    rows of the partitions are stored as index ('<table>.partitions/<key>' and '<table>.partitions.offsets'), so
+    read_dataset() reads only the rows of the requested partitions.
+    Text columns are stored as fixed-width strings (no pickle required for loading).
 
-    # Sampling rate 120 hz / sampling length 8.3333 ms
-    # We pre-registered inclusion criteria for each trial
-    # Check Inclusion Criteria
-    th_dict = {'baseline': 1, 'contingent': 10, 'disruption': .5}  # in seconds
-    for phase in PHASES:
-        for trial_name in trial_names:
-            df = trial_phase_data[trial_name][phase]
-            if len(df['time']) * ((1000 / 120) * 1000) < th_dict[phase]:
-                print('Inclusion Criteria not matched.')
-                print(f"Trial name: '{trial_name}' | Phase: '{phase}':\n | Deleted")
-                del df
-            else:
-                print('Inclusion Criteria matched.')
-                print(f"Trial name: '{trial_name}' | Phase: '{phase}':\n")
+    :param path: path of dataset file
+    :param tables: dict of table name and DataFrame, e.g., {"durations": df_dur, "fixations": df_fix}
+    :param keys: partition keys, columns not present in a table are ignored
+    """
+    arrays = {}
+    for name, df in tables.items():
+        table_keys = [key for key in keys if key in df.columns]
+        if table_keys and len(df):
+            df = df.sort_values(table_keys, kind='mergesort')
+        arrays.update(_table_arrays(name, df))
+        if table_keys:
+            # Index of partitions: key values of their first rows and offsets of their blocks of rows
+            group = df.groupby(table_keys, sort=False, dropna=False).ngroup().to_numpy()
+            starts = np.flatnonzero(np.diff(group, prepend=-1))
+            arrays.update(_table_arrays(f"{name}.partitions", df[table_keys].iloc[starts]))
+            arrays[f"{name}.partitions.offsets"] = np.append(starts, len(df))
+
+    # Write to temporary file first, so an interrupted run does not leave a broken dataset
+    path_tmp = path + ".tmp.npz"
+    np.savez(path_tmp, **arrays)
+    os.replace(path_tmp, path)
+
+
+def _dataset_column(path: str, dataset, name: str) -> np.ndarray:
+    """
+    Get an array of a dataset file without reading it: the uncompressed .npy member is memory-mapped, so only the
+    rows sliced from it are read (see read_dataset()). Other arrays (e.g., compressed or empty) are read whole.
+    """
+    import struct
+    import zipfile
 
-    # Calculate Fixations per Trial and Phase and Store in new nested dictionary -fixation_data-
-    fixation_data = deepcopy(trial_phase_data)  # deepcopy (!important for dict!  structure)
+    info = dataset.zip.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        return dataset[name]
+    with open(path, "rb") as f:
+        # Data of member starts after the local file header (30 bytes, file name and extra field)
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", f.read(4))
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else \
+            np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+    if fortran_order or dtype.hasobject or 0 in shape:
+        return dataset[name]
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+def read_dataset(path: str, table: str, columns=None, **filters) -> pd.DataFrame:
+    """
+    Read one table of a dataset written by write_dataset().
+
+    Filters on partition keys select the partitions from the index of the table, and only their blocks of rows
+    are read from the filter columns and the requested columns, e.g.:
+        read_dataset("GSP_cohort.npz", "fixations", ID=["ID_1", "ID_2"], Phase="baseline", AOI="rise")
+    Filters on other columns (or tables without index) select the rows from the rows read.
+
+    :param path: path of dataset file
+    :param table: name of table (e.g., "durations", "fixations", "aoi")
+    :param columns: list of columns to read, None: all columns
+    :param filters: column name and value (or list of values) of rows to read
+    :return: table
+    """
+    with np.load(path) as dataset:
+        prefix = f"{table}/"
+        table_columns = [name[len(prefix):] for name in dataset.files if name.startswith(prefix)]
+        if not table_columns:
+            raise KeyError(f"Table '{table}' not found in dataset '{path}'.")
+
+        # Blocks of rows of the selected partitions (adjacent partitions merged)
+        index_prefix = f"{table}.partitions/"
+        index_keys = [name[len(index_prefix):] for name in dataset.files if name.startswith(index_prefix)]
+        row_filters = {column: values for column, values in filters.items() if column not in index_keys}
+        if index_keys:
+            offsets = dataset[f"{table}.partitions.offsets"]
+            selected = np.ones(len(offsets) - 1, dtype=bool)
+            for column, values in filters.items():
+                if column in index_keys:
+                    selected &= np.isin(dataset[index_prefix + column], np.atleast_1d(values))
+            edges = np.flatnonzero(np.diff(np.concatenate([[False], selected, [False]]).astype(np.int8)))
+            blocks = list(zip(offsets[edges[0::2]], offsets[edges[1::2]]))
+        else:
+            blocks = None
+
+        def _read(column: str) -> np.ndarray:
+            if blocks is None:
+                return dataset[prefix + column]
+            values = _dataset_column(path, dataset, prefix + column)
+            return np.concatenate([values[:0]] + [values[start:stop] for start, stop in blocks])
+
+        mask = None
+        for column, values in row_filters.items():
+            column_mask = np.isin(_read(column), np.atleast_1d(values))
+            mask = column_mask if mask is None else mask & column_mask
+
+        return pd.DataFrame({column: np.asarray(_read(column)) if mask is None else _read(column)[mask]
+                             for column in (table_columns if columns is None else columns)})
+
+
+def file_fingerprint(path: str, chunk_size: int = 1 << 20) -> str:
+    """Get the sha1 hash of the content of a file (independent of its path and modification time)."""
+    import hashlib
+
+    file_hash = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+_CODE_FINGERPRINT: str = None  # see code_fingerprint()
+
+
+def code_fingerprint() -> str:
+    """Get the sha1 hash of the source of this module (computed once per process)."""
+    global _CODE_FINGERPRINT
+    if _CODE_FINGERPRINT is None:
+        _CODE_FINGERPRINT = file_fingerprint(os.path.abspath(__file__))
+    return _CODE_FINGERPRINT
+
+
+def result_key(stage: str, fingerprint: str, params: dict) -> str:
+    """
+    Get the key of a stored result (content address) from the stage, the fingerprint of its input, the
+    parameters which change its result and the fingerprint of the processing code (any change of this module
+    invalidates the stored results).
+    """
+    import hashlib
 
-    for trial_name in trial_names:  # ~ trial_phase_data.keys():
-        for phase in PHASES:
-            df_temp = trial_phase_data[trial_name][phase]
-            # Append fixation dictionary
-            fixation_data[trial_name][phase] = compute_df_e_fix(df_temp)
-            # _e_fix has the format ['Start','End','Duration', 'X', 'Y']
+    text = json.dumps({"stage": stage, "input": fingerprint, "params": params, "code": code_fingerprint()},
+                      sort_keys=True, default=str)
+    return f"{stage}_{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
 
-    # Description Dataset Fixations
-    for trial_name in trial_names:  # ~ trial_phase_data.keys():
-        for phase in PHASES:
-            print(f"Trial name: '{trial_name}' | Phase: '{phase}':\n")
-            print(len(fixation_data[trial_name][phase]))
-
-    # Split Data from -trial_phase_data- into AOIs 'drop' and 'rise' for each trial and each phase
-    # and write in new nested dictionary -trial_phase_aoi_data-
-
-    # Two possible frames for the area of interest:
-    #   Full Screen divided in four quadrants:
-    #   (tp_df['gaze_point_x'] < 640) & (tp_df['gaze_point_y'] < 512)
-    #   |  (tp_df['gaze_point_x'] > 640) & (tp_df['gaze_point_y'] > 512)
-    #
-    #   Quadrants focused on objects in corners of the screen:
-    #   (tp_df['gaze_point_x'] < 478) & (tp_df['gaze_point_y'] < 382)
-    #   | (tp_df['gaze_point_x'] > 802) & (tp_df['gaze_point_y'] > 642)
-
-    trial_phase_aoi_data = deepcopy(trial_phase_data)
-    for trial_name in trial_names:
-        for phase in PHASES:
-            tp_df = trial_phase_aoi_data[trial_name][phase]  # use short naming for code below
-
-            # Alternative AOI tl_br_df // DROP_edge
-            tl_br_df = tp_df[
-                (
-                        (tp_df['gaze_point_x'] < 478) & (tp_df['gaze_point_y'] < 382)
-                        | (tp_df['gaze_point_x'] > 802) & (tp_df['gaze_point_y'] > 642)
-                )
-            ].copy()
-
-            # Alternative AOI tr_bl_df // RISE_edge
-            tr_bl_df = tp_df[
-                (
-                        (tp_df['gaze_point_x'] > 802) & (tp_df['gaze_point_y'] < 382)
-                        | (tp_df['gaze_point_x'] < 478) & (tp_df['gaze_point_y'] > 642)
-                )
-            ].copy()
-
-            # Overwrite initial df of phase in trial with dict that contains data split into two areas
-            # of interest (AOI)
-            trial_phase_aoi_data[trial_name][phase] = {
-                "drop": tl_br_df, "rise": tr_bl_df}  # == dict(tl_br=tl_br_df, tr_bl=tr_bl_df)
-
-    # Calculate Fixations per Trial and Phase and AOI_Drop_edge and Store in new nested
-    # dictionary -fixation_data_drop-
-    fixation_data_drop = deepcopy(trial_phase_aoi_data)  # deepcopy (!important for dict! structure)
-
-    for trial_name in trial_names:  # ~ trial_phase_data.keys():
-        for phase in PHASES:
-            df_temp = trial_phase_aoi_data[trial_name][phase]["drop"]
-            # append fixation dictionary
-            fixation_data_drop[trial_name][phase]["drop"] = compute_df_e_fix(df_temp)
-            # _e_fix has the format ['Start','End','Duration', 'X', 'Y']
 
-    # Calculate Fixations per Trial and Phase and AOI_Rise_edge and Store in new nested
-    # dictionary -fixation_data_rise-
-    fixation_data_rise = deepcopy(trial_phase_aoi_data)  # deepcopy
+def save_result(key: str, result: dict, meta: dict = None, store_dir: str = RESULTS_PATH) -> None:
+    """
+    Save the result of a stage in the results store (one uncompressed .npz file per key).
 
-    for trial_name in trial_names:  # ~ trial_phase_data.keys():
-        for phase in PHASES:
-            df_temp = trial_phase_aoi_data[trial_name][phase]["rise"]
-            # Append fixation dictionary
-            fixation_data_rise[trial_name][phase]["rise"] = compute_df_e_fix(df_temp)
-            # _e_fix has the format ['Start','End','Duration', 'X', 'Y']
+    :param key: key of result, see result_key()
+    :param result: dict of name and table (DataFrame) or array
+    :param meta: description of the result (e.g., subject, trial, stage, input fingerprint and parameters)
+    :param store_dir: path to results store
+    """
+    arrays = {"meta": np.array(json.dumps(meta or {}, default=str))}
+    for name, value in result.items():
+        if isinstance(value, pd.DataFrame):
+            arrays.update(_table_arrays(name, value))
+        else:
+            arrays[name] = value
+
+    # Write to temporary file first, so parallel or interrupted runs do not leave broken results
+    os.makedirs(store_dir, exist_ok=True)
+    path = os.path.join(store_dir, f"{key}.npz")
+    path_tmp = path + f".{os.getpid()}.tmp.npz"
+    np.savez(path_tmp, **arrays)
+    os.replace(path_tmp, path)
+
+
+def load_result(key: str, store_dir: str = RESULTS_PATH):
+    """
+    Load a result saved by save_result().
 
-    # This can be used to test dictionaries
-    # *Note: You can iterate through trials and PHASES*
-    for trial_name in trial_names:
-        # ~ trial_phase_data.keys():  (Note: python list's are ordered, keys, hence dicts aren't)\n",
-        for phase in PHASES:  # ~ trial_phase_data[trial_name].keys():
-            print(f"Trial name: '{trial_name}' | Phase: '{phase}':\n")
-            print(fixation_data_rise[trial_name][phase]['rise'].head())
-            print("\t\t...  ")
-            print(fixation_data_rise[trial_name][phase]['rise'].tail(), "\n\n\n")
-            break
-        break
+    :return: dict of name and table (DataFrame) or array, None if the result is not stored
+    """
+    path = os.path.join(store_dir, f"{key}.npz")
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as stored:
+        result = {}
+        for name in stored.files:
+            if "/" in name:
+                table, column = name.split("/", 1)
+                result.setdefault(table, {})[column] = stored[name]
+            elif name != "meta":
+                result[name] = stored[name]
+    return {name: pd.DataFrame(value) if isinstance(value, dict) else value for name, value in result.items()}
+
+
+def clear_results(store_dir: str = RESULTS_PATH) -> int:
+    """
+    Remove all results from the results store.
 
-    # At this point all five dictionaries are build. Variables can now be extracted for further analysis.
-    # trial_phase_data: contains gaze data separated into trials and PHASES
-    # fixation_data: contains fixation data for trials and PHASES
-    # trial_phase_aoi_data: contains only gaze data for both AOIs separated into trials and PHASES
-    # fixation_data_drop: contains only fixation data for AOI drop
-    # fixation_data_rise: contains only fixation data for AOI rise
+    :return: number of removed results
+    """
+    if not os.path.isdir(store_dir):
+        return 0
+    n_removed = 0
+    for fn in os.listdir(store_dir):
+        if fn.endswith(".npz"):
+            os.remove(os.path.join(store_dir, fn))
+            n_removed += 1
+    return n_removed
 
-    ###
-    # Calculate Parameters DLS, sum, mean and std for duration for baseline phase
-    ###
 
-    # Dataframe with Sum of Duration in AOI-rise per Trial
-    df_rise = compute_duration_rise(current_phase=PHASES[0],  # baseline phase
-                                    fix_data_rise=fixation_data_rise,
-                                    trial_names=trial_names)
+class RunReport:
+    """
+    Collect wall time, number of samples and peak memory per stage of the processing pipeline.
+
+    Usage:
+        report = RunReport(trace_memory=True, subject="ID_52b")
+        with report.stage("load") as stage:
+            trial_data = load_trial(...)
+            stage["samples"] += len(trial_data)
+        report.finish()
+        report.save("RUN_ID_52b.json")
+
+    Stages can be entered several times (e.g., once per trial), their counters are accumulated.
+    Peak memory (in MB) is measured with tracemalloc and is the maximum of all calls of a stage.
+    """
 
-    # Dataframe with Sum of Duration in AOI-drop per Trial
-    df_drop = compute_duration_drop(current_phase=PHASES[0],
-                                    fix_data_drop=fixation_data_drop,
-                                    trial_names=trial_names)
+    def __init__(self, trace_memory: bool = False, **meta):
+        self.trace_memory = trace_memory
+        self.meta = meta
+        self.stages = {}
+        self.total_time = None
+        self._started_tracing = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._time_start = perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        record = self.stages.setdefault(name, {"calls": 0, "time": 0., "samples": 0, "peak_mb": None})
+        if self.trace_memory:
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.clear_traces()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        time_start = perf_counter()
+        try:
+            yield record
+        finally:
+            record["time"] += perf_counter() - time_start
+            record["calls"] += 1
+            if self.trace_memory:
+                peak_mb = (tracemalloc.get_traced_memory()[1] - memory_start) / 1024 ** 2
+                record["peak_mb"] = max(record["peak_mb"] or 0., peak_mb)
+
+    def finish(self) -> None:
+        """Stop the run (total time) and memory tracing."""
+        self.total_time = perf_counter() - self._time_start
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def to_dict(self) -> dict:
+        return dict(self.meta, total_time=self.total_time, stages=self.stages)
+
+    def save(self, path: str) -> None:
+        """Save run report as json file."""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def discover_subjects(data_root: str, ids: list = None, conditions: list = None) -> list:
+    """
+    Find all '<data_root>/<ID>/<condition>' directories.
 
-    ###
-    # Dataframe with Sum of Duration in AOI-rise + AOI-drop + total Duration + DLS per Trial
-    ###
-    add_drop_and_save(current_df_rise=df_rise, current_df_drop=df_drop, condition=FLAGS.condition,
-                      save_dir=SAVE_PATH_DF_RISE)
+    :param data_root: path to data directory
+    :param ids: subject IDs or glob patterns (e.g., 'ID_5*'), None for all subjects
+    :param conditions: conditions (e.g., 'Rise'), None for all conditions
+    :return: list of (subject ID, condition) tuples
+    """
+    from fnmatch import fnmatch
+
+    if conditions is not None:
+        conditions = [cond.lower() for cond in conditions]
+
+    subjects = []
+    for subject_id in sorted(os.listdir(data_root)):
+        subject_path = os.path.join(data_root, subject_id)
+        if not os.path.isdir(subject_path):
+            continue
+        if ids is not None and not any(fnmatch(subject_id, pattern) for pattern in ids):
+            continue
+        for condition_dir in sorted(os.listdir(subject_path)):
+            if not os.path.isdir(os.path.join(subject_path, condition_dir)):
+                continue
+            if conditions is not None and condition_dir.lower() not in conditions:
+                continue
+            subjects.append((subject_id, condition_dir.title()))
+    return subjects
+
+
+def _process_subject_safe(subject_id: str, condition: str, **kwargs):
+    """
+    Run process_subject() in a worker process and return the error instead of stopping the whole cohort.
+
+    :return: (output tables, None) or (None, error message with traceback) if processing failed
+    """
+    import traceback
 
-    # Export Fixation Data to csv files per child, trial and phase
-    df_fix_to_csv(current_phase=PHASES[0], fix_data=fixation_data, trial_names=trial_names)
+    try:
+        return process_subject(subject_id, condition, **kwargs), None
+    except Exception as e:
+        print(f"Processing of '{subject_id}' in condition '{condition}' failed: {e!r}")
+        return None, traceback.format_exc()
 
-    ###
-    # Calculate Parameters DLS, sum, mean and std for duration for contingent phase
-    ###
 
-    # Dataframe with Sum of Duration in AOI-rise per Trial
-    df_rise = compute_duration_rise(current_phase=PHASES[1],  # contingent phase
-                                    fix_data_rise=fixation_data_rise,
-                                    trial_names=trial_names)
+def process_cohort(subjects: list, jobs: int = 1, **kwargs) -> dict:
+    """
+    Process many participants and conditions, optionally in parallel.
 
-    # Dataframe with Sum of Duration in AOI-drop per Trial
-    df_drop = compute_duration_drop(current_phase=PHASES[1],
-                                    fix_data_drop=fixation_data_drop,
-                                    trial_names=trial_names)
+    :param subjects: list of (subject ID, condition) tuples, see discover_subjects()
+    :param jobs: number of worker processes (1: process all subjects in this process)
+    :param kwargs: passed on to process_subject()
+    :return: output tables of all subjects in one cohort table each (see process_subject()), and the table
+             "failed" of subjects whose processing failed (ID, Condition, Error), empty if all succeeded
+    """
+    if jobs > 1 and len(subjects) > 1:
+        from concurrent.futures import ProcessPoolExecutor
 
-    ###
-    # Dataframe with Sum of Duration in AOI-rise + AOI-drop + total Duration + DLS per Trial
-    ###
-    add_drop_and_save(current_df_rise=df_rise, current_df_drop=df_drop, condition=FLAGS.condition,
-                      save_dir=SAVE_PATH_DF_RISE)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_process_subject_safe, subject_id, condition, **kwargs)
+                       for subject_id, condition in subjects]
+            results = [future.result() for future in futures]
+    else:
+        results = [_process_subject_safe(subject_id, condition, **kwargs) for subject_id, condition in subjects]
+
+    failed = [[subject_id, condition, error]
+              for (subject_id, condition), (_, error) in zip(subjects, results) if error is not None]
+    df_failed = pd.DataFrame(failed, columns=['ID', 'Condition', 'Error'])
+    results = [tables for tables, _ in results if tables is not None]
+    if not results:
+        return {"failed": df_failed}
+    cohort = {name: pd.concat([tables[name] for tables in results], ignore_index=True) for name in results[0]}
+    cohort["failed"] = df_failed
+    return cohort
+
+
+def iter_trials(subject_data_path: str, trial_names, use_cache: bool = True, cache_dir: str = CACHE_PATH,
+                report: RunReport = None, min_valid: dict = None, resample_rate: float = None,
+                resample_max_gap: float = RESAMPLE_MAX_GAP):
+    """
+    Load the trials of a participant one after another, check their data quality, (resample,) clean them and
+    split them into PHASES.
+
+    This is a generator: only the trial currently processed is held in memory. Each trial is loaded whole (its
+    samples are sorted and the disruption phase is found from its last time stamp), hence peak memory grows with
+    the length of the longest recording, not with the number of trials.
+
+    :param subject_data_path: path to trial csv files of participant in one condition
+    :param trial_names: file names of trials
+    :param use_cache: use binary cache of trial csv files (see load_trial())
+    :param cache_dir: path to cache directory
+    :param report: RunReport to record the stages 'load', 'QC', 'resample' and 'segment'
+    :param min_valid: minimal valid duration per phase (in seconds), see trial_quality()
+    :param resample_rate: rate of uniform time grid the trials are resampled to (in Hz), see resample_trial(),
+                          None: no resampling
+    :param resample_max_gap: longest gap of valid data which is interpolated by resampling (in seconds)
+    :return: generator of (trial name, {phase: gaze data}, data quality per phase (see trial_quality()))
+    """
+    report = RunReport() if report is None else report
+    for trial_name in trial_names:
+        with report.stage("load") as stage:
+            # Read whole trial data
+            trial_data = load_trial(os.path.join(subject_data_path, trial_name), use_cache=use_cache,
+                                    cache_dir=cache_dir)
+            if not trial_data['time'].is_monotonic_increasing:
+                trial_data = trial_data.sort_values('time', kind='mergesort').reset_index(drop=True)
+            stage["samples"] += len(trial_data)
+
+        # Data quality per phase of the recorded gaze data (inclusion criteria)
+        with report.stage("QC") as stage:
+            valid = trial_data.notna().all(axis=1).to_numpy()
+            df_qc = trial_quality(trial_data['time'], valid, phase_index(trial_data['time'].to_numpy()),
+                                  min_valid=min_valid)
+            stage["samples"] += len(valid)
+
+        # Uniform time grid, short gaps are interpolated
+        if resample_rate is not None:
+            with report.stage("resample") as stage:
+                trial_data = resample_trial(trial_data, rate=resample_rate, max_gap=resample_max_gap)
+                valid = trial_data.notna().all(axis=1).to_numpy()
+                stage["samples"] += len(trial_data)
+
+        with report.stage("segment") as stage:
+            # Divide data into the three PHASES (baseline/contingent/disruption) of the experiment
+            # make sure the timing is correct and matches you trial design (see phase_index())
+            phase_bounds = phase_index(trial_data['time'].to_numpy())
+
+            # Clean Data per Trial (drop 'nan' values) and shift the phase boundaries accordingly
+            if not valid.all():
+                trial_data = trial_data[valid].reset_index(drop=True)
+            n_valid = np.concatenate([[0], np.cumsum(valid)])
+            trial_phase_index = {phase: (int(n_valid[start]), int(n_valid[stop]))
+                                 for phase, (start, stop) in phase_bounds.items()}
+
+            # PHASES are views into the trial data (no copies)
+            trial_phase_data = {phase: trial_data.iloc[start:stop]
+                                for phase, (start, stop) in trial_phase_index.items()}
+            stage["samples"] += len(trial_data)
+
+        yield trial_name, trial_phase_data, df_qc
+
+
+def process_trial(trial_name: str, trial_phase_data: dict, aoi: str = AOI, max_dist: float = FIXATION_MAX_DIST,
+                  min_dur: float = FIXATION_MIN_DUR, sweep: tuple = None, heatmap_tile: int = None,
+                  report: RunReport = None, detector: str = FIXATION_DETECTOR,
+                  max_velocity: float = FIXATION_MAX_VELOCITY) -> dict:
+    """
+    Split the gaze data of one trial into AOIs and compute fixations and dwell times per phase and AOI.
+
+    :param trial_name: name of trial
+    :param trial_phase_data: gaze data per phase, see iter_trials()
+    :param aoi: name of AOI definition (see AOI_DEFINITIONS)
+    :param max_dist: dispersion threshold of fixation detection (in pixels)
+    :param min_dur: minimal duration of fixations (in seconds)
+    :param sweep: (list of max_dist, list of min_dur) to compute the DLS for every combination, None: no sweep
+    :param heatmap_tile: size of heatmap tiles in pixels (e.g., HEATMAP_TILE), None: no heatmaps
+    :param report: RunReport to record the stages 'AOI split', 'fixation', 'sweep' and 'heatmap'
+    :param detector: fixation detector, 'idt' (dispersion) or 'ivt' (velocity threshold)
+    :param max_velocity: velocity threshold of the 'ivt' detector (in pixels per second)
+    :return: tables of trial: "fixations" (per phase and AOI, 'all': all fixations of the phase),
+             "aoi" (samples and dwell time per phase and AOI), "sweep" (only with sweep, see compute_dls()),
+             "heatmaps" (only with heatmap_tile: keys and {"gaze": gaze samples, "fixation": fixation duration}
+             per phase and AOI, see bin_heatmaps())
+    """
+    report = RunReport() if report is None else report
+    aoi_names = list(AOI_DEFINITIONS[aoi])
 
-    # Export Fixation Data to csv files per child, trial and phase
-    df_fix_to_csv(current_phase=PHASES[1], fix_data=fixation_data, trial_names=trial_names)
+    # Split Data into AOIs for each phase, every sample is labelled once with the code of its AOI
+    with report.stage("AOI split") as stage:
+        segments = {}
+        aoi_rows = []
+        for phase in PHASES:
+            tp_df = trial_phase_data[phase]  # use short naming for code below
+            labels = label_aoi(tp_df['gaze_point_x'], tp_df['gaze_point_y'], AOI_DEFINITIONS[aoi])
+            stage["samples"] += len(labels)
+
+            # Samples of each AOI (in time order)
+            order, aoi_offsets = group_by_aoi(labels, n_aoi=len(aoi_names))
+            segments[(trial_name, phase, "all")] = tp_df
+            for code, aoi_name in enumerate(aoi_names, start=1):
+                segments[(trial_name, phase, aoi_name)] = tp_df.iloc[
+                    order[aoi_offsets[code]:aoi_offsets[code + 1]]]
+
+            # Dwell time per AOI
+            n_samples, dwell = aoi_dwell(labels, tp_df['time'], n_aoi=len(aoi_names))
+            for code, aoi_name in enumerate(aoi_names, start=1):
+                aoi_rows.append([trial_name, phase, aoi_name, n_samples[code], dwell[code]])
+
+    # Calculate Fixations per Phase, and per Phase and AOI in one batch over all segments of the trial
+    with report.stage("fixation") as stage:
+        samples, offsets, keys = concat_segments(segments, names=['Trial', 'Phase', 'AOI'])
+        trial_tables = {
+            "fixations": compute_df_fix_segments(samples, offsets, keys, max_dist=max_dist, min_dur=min_dur,
+                                                 detector=detector, max_velocity=max_velocity),
+            "aoi": pd.DataFrame(aoi_rows, columns=['Trial', 'Phase', 'AOI', 'Samples', 'Dwell'])}
+        stage["samples"] += len(samples)
+
+    # Fixations and DLS for every combination of max_dist and min_dur (robustness checks)
+    if sweep is not None:
+        with report.stage("sweep") as stage:
+            max_dists, min_durs = sweep
+            df_fix_sweep = compute_df_fix_sweep(samples, offsets, keys, max_dists=max_dists, min_durs=min_durs,
+                                                detector=detector, max_velocity=max_velocity)
+            by = ['Max_Dist', 'Min_Dur', 'Phase', 'Trial']
+            groups = pd.MultiIndex.from_product([max_dists, min_durs, PHASES, [trial_name]], names=by).to_frame()
+            trial_tables["sweep"] = compute_dls(df_fix_sweep, by=by, groups=groups)
+            stage["samples"] += len(samples) * len(max_dists)
+
+    # Heatmaps of gaze samples and fixation durations per phase and AOI, each in one histogram pass
+    if heatmap_tile is not None:
+        with report.stage("heatmap") as stage:
+            segment = np.repeat(np.arange(len(keys)), np.diff(offsets))
+            gaze_grids = bin_heatmaps(samples['gaze_point_x'], samples['gaze_point_y'], segment, len(keys),
+                                      tile=heatmap_tile)
+            df_fix = trial_tables["fixations"]
+            fix_segment = pd.MultiIndex.from_frame(keys).get_indexer(
+                pd.MultiIndex.from_frame(df_fix[list(keys.columns)]))
+            fix_y = df_fix['Y'].to_numpy(dtype=float)
+            if FLIP_Y is not None:
+                fix_y = FLIP_Y - fix_y  # back to screen coordinates
+            fix_grids = bin_heatmaps(df_fix['X'], fix_y, fix_segment, len(keys), weights=df_fix['Duration'],
+                                     tile=heatmap_tile)
+            trial_tables["heatmaps"] = (keys, {"gaze": gaze_grids, "fixation": fix_grids})
+            stage["samples"] += len(samples)
+
+    return trial_tables
+
+
+def _trial_stage_params(aoi: str, max_dist: float, min_dur: float, sweep: tuple, heatmap_tile: int,
+                        detector: str, max_velocity: float, resample: tuple = None) -> dict:
+    """Get the parameters of each stored stage of a trial (only those which change its results)."""
+    fixation = {"aoi": list(AOI_DEFINITIONS[aoi].items()), "screen_size": AOI_SCREEN_SIZE, "flip_y": FLIP_Y,
+                "detector": detector, "max_dist": max_dist, "min_dur": min_dur}
+    if resample is not None:
+        fixation["resample"] = resample
+    if detector == "ivt":
+        fixation.update(max_velocity=max_velocity, max_gap=FIXATION_MAX_GAP, window=FIXATION_VELOCITY_WINDOW)
+    stage_params = {"qc": {"min_valid": QC_MIN_VALID}, "fixations": fixation}
+    if sweep is not None:
+        stage_params["sweep"] = dict({key: value for key, value in fixation.items()
+                                      if key not in ("max_dist", "min_dur")}, sweep=sweep)
+    if heatmap_tile is not None:
+        stage_params["heatmaps"] = dict(fixation, tile=heatmap_tile)
+    return stage_params
+
+
+def _missing_stages(results: dict, stage_params: dict, qc: bool = True) -> list:
+    """Get the stages of a trial which still have to be computed (none but QC for excluded trials)."""
+    if "qc" not in results:
+        return ["qc"] + [name for name in stage_params if name != "qc"]
+    if qc and not results["qc"]["qc"]['Pass'].all():
+        return []
+    return [name for name in stage_params if name not in results]
+
+
+def process_subject(subject_id: str, condition: str, data_root: str = DATA_ROOT_PATH,
+                    save_path_dur: str = SAVE_PATH_DF_RISE,
+                    save_path_fix: str = SAVE_PATH_FIXATION_OVERALL, use_cache: bool = True,
+                    cache_dir: str = CACHE_PATH, aoi: str = AOI, verbose: bool = True,
+                    report_dir: str = None, trace_memory: bool = False, csv: bool = True,
+                    max_dist: float = FIXATION_MAX_DIST, min_dur: float = FIXATION_MIN_DUR,
+                    sweep: tuple = None, heatmap_tile: int = None, detector: str = FIXATION_DETECTOR,
+                    max_velocity: float = FIXATION_MAX_VELOCITY, qc: bool = True, use_store: bool = True,
+                    store_dir: str = RESULTS_PATH, resample_rate: float = None,
+                    resample_max_gap: float = RESAMPLE_MAX_GAP) -> dict:
+    """
+    Process one participant in one condition of the gaze scratch paradigm.
+
+    :param subject_id: subject ID
+    :param condition: condition for Rise/Drop Trials
+    :param data_root: path to data directory
+    :param save_path_dur: path to save DLS/duration tables
+    :param save_path_fix: path to save fixation data
+    :param use_cache: use binary cache of trial csv files (see load_trial())
+    :param cache_dir: path to cache directory
+    :param aoi: name of AOI definition (see AOI_DEFINITIONS)
+    :param verbose: False: do not print data per trial and phase
+    :param report_dir: path to save run report 'RUN_{ID}_{CONDITION}.json' with time, samples (and memory)
+                       per stage (see RunReport), None: no report
+    :param trace_memory: trace peak memory per stage for the run report (slows down processing)
+    :param csv: save tables as csv files per phase (and trial) as well
+    :param max_dist: dispersion threshold of fixation detection (in pixels)
+    :param min_dur: minimal duration of fixations (in seconds)
+    :param sweep: (list of max_dist, list of min_dur) to compute the DLS for every combination, None: no sweep
+    :param heatmap_tile: size of heatmap tiles in pixels, heatmaps per trial, phase and AOI are saved in
+                         'HEAT_{ID}_{CONDITION}.npz' (see write_heatmaps()), None: no heatmaps
+    :param detector: fixation detector, 'idt' (dispersion) or 'ivt' (velocity threshold)
+    :param max_velocity: velocity threshold of the 'ivt' detector (in pixels per second)
+    :param qc: exclude trials which do not match the inclusion criteria (see trial_quality()) from fixation
+               detection and aggregation, False: process all trials (the QC table is saved anyway)
+    :param use_store: reuse the results of trials and stages whose input file and parameters did not change
+                      and store new results (see result_key()), False: process all trials from their csv files
+    :param store_dir: path to results store
+    :param resample_rate: resample trials onto a uniform time grid with this rate (in Hz) before fixation
+                          detection (see resample_trial()), None: no resampling
+    :param resample_max_gap: longest gap of valid data which is interpolated by resampling (in seconds)
+    :return: output tables (see write_dataset()):
+             "qc": data quality per trial and phase with the column 'Include' (see trial_quality()),
+             "durations": DLS/duration table of all phases (included trials),
+             "fixations": fixations per trial, phase and AOI ('all': all fixations of the phase),
+             "aoi": dwell time and fixations per trial, phase and AOI,
+             "sweep": DLS/duration table per max_dist and min_dur (only with sweep)
+    """
+    report = RunReport(trace_memory=trace_memory and report_dir is not None, subject=subject_id,
+                       condition=condition, detector=detector)
 
-    ###
-    # Calculate Parameters DLS, sum, mean and std for duration for disruption phase
-    ###
+    # Set paths
+    subject_data_path = os.path.join(data_root, subject_id, condition.lower())
+    files_gsp = os.listdir(subject_data_path)
+    trial_names = sorted([trial_fn.split("_")[0] for trial_fn in files_gsp])
 
-    # Dataframe with Sum of Duration in AOI-rise per Trial
-    df_rise = compute_duration_rise(current_phase=PHASES[2],  # disruption phase
-                                    fix_data_rise=fixation_data_rise,
-                                    trial_names=trial_names)
+    # Load csv files for one participant and define names for trials and PHASES.
+    if verbose:
+        print("Trial names:\n", trial_names)
+
+    # Results of each trial and stage are looked up in the results store first, only trials with missing
+    # (or outdated) results are processed (see result_key())
+    stage_params = _trial_stage_params(aoi=aoi, max_dist=max_dist, min_dur=min_dur, sweep=sweep,
+                                       heatmap_tile=heatmap_tile, detector=detector, max_velocity=max_velocity,
+                                       resample=(resample_rate, resample_max_gap) if resample_rate else None)
+    trial_keys = {}
+    trial_results = {trial_name: {} for trial_name in trial_names}
+    if use_store:
+        with report.stage("store") as stage:
+            for trial_name in trial_names:
+                fingerprint = file_fingerprint(os.path.join(subject_data_path, trial_name))
+                trial_keys[trial_name] = {name: result_key(name, fingerprint, dict(params, trial=trial_name))
+                                          for name, params in stage_params.items()}
+                results = trial_results[trial_name]
+                for name, key in trial_keys[trial_name].items():
+                    if "qc" in results and not _missing_stages(results, stage_params, qc=qc):
+                        break  # e.g., excluded trial, its further results are not needed
+                    result = load_result(key, store_dir=store_dir)
+                    if result is not None:
+                        results[name] = result
+                        stage["samples"] += 1
+    pending = [trial_name for trial_name in trial_names if _missing_stages(trial_results[trial_name],
+                                                                           stage_params, qc=qc)]
+    if verbose and use_store:
+        print(f"Trials with stored results: {len(trial_names) - len(pending)}, to process: {len(pending)}")
+
+    # Trials flow one after another through load -> segment -> QC -> AOI split -> fixations,
+    # only the per-trial results (fixations, dwell times) are kept (see iter_trials() and process_trial())
+    for trial_name, trial_phase_data, df_qc in iter_trials(
+            subject_data_path, pending, use_cache=use_cache, cache_dir=cache_dir, report=report,
+            resample_rate=resample_rate, resample_max_gap=resample_max_gap):
+        results = trial_results[trial_name]
+        new_results = {"qc": {"qc": df_qc}} if "qc" not in results else {}
+        results.update(new_results)
+        missing = _missing_stages(results, stage_params, qc=qc)
+        if missing:
+            trial_tables = process_trial(trial_name, trial_phase_data, aoi=aoi, max_dist=max_dist, min_dur=min_dur,
+                                         sweep=sweep if "sweep" in missing else None,
+                                         heatmap_tile=heatmap_tile if "heatmaps" in missing else None,
+                                         report=report, detector=detector, max_velocity=max_velocity)
+            if "fixations" in missing:
+                new_results["fixations"] = {"fixations": trial_tables["fixations"], "aoi": trial_tables["aoi"]}
+            if "sweep" in missing:
+                new_results["sweep"] = {"sweep": trial_tables["sweep"]}
+            if "heatmaps" in missing:
+                heat_keys, grids = trial_tables["heatmaps"]
+                new_results["heatmaps"] = dict(grids, keys=heat_keys)
+            results.update(new_results)
+
+        if use_store:
+            with report.stage("store"):
+                for name, result in new_results.items():
+                    save_result(trial_keys[trial_name][name], result, store_dir=store_dir, meta=dict(
+                        subject=subject_id, condition=condition, trial=trial_name, stage=name,
+                        params=stage_params[name], code=code_fingerprint()))
+
+    aoi_names = list(AOI_DEFINITIONS[aoi])
+    qc_tables = []
+    fix_tables = []
+    aoi_tables = []
+    sweep_tables = []
+    heatmaps = []
+    for trial_name in trial_names:
+        results = trial_results[trial_name]
+        # We pre-registered inclusion criteria for each trial (valid gaze data per phase, see QC_MIN_VALID)
+        df_qc = results["qc"]["qc"]
+        include = bool(df_qc['Pass'].all())
+        qc_tables.append(df_qc.assign(Trial=trial_name, Include=include))
+        if not include:
+            failed = df_qc.loc[~df_qc['Pass'], 'Phase'].tolist()
+            print(f"Inclusion Criteria not matched. Trial name: '{trial_name}' | Phase(s): {failed}"
+                  + (" | Excluded" if qc else ""))
+            if qc:
+                continue
+        elif verbose:
+            print(f"Inclusion Criteria matched. Trial name: '{trial_name}'")
+
+        fix_tables.append(results["fixations"]["fixations"])
+        aoi_tables.append(results["fixations"]["aoi"])
+        if sweep is not None:
+            sweep_tables.append(results["sweep"]["sweep"])
+        if heatmap_tile is not None:
+            grids = dict(results["heatmaps"])
+            heatmaps.append((grids.pop("keys"), grids))
+
+    # Data quality of all trials, only included trials are processed further
+    df_qc = pd.concat(qc_tables, ignore_index=True) if qc_tables else pd.DataFrame(
+        columns=QC_COLUMNS + ['Trial', 'Include'])
+    df_qc = df_qc[['Trial', 'Include'] + QC_COLUMNS]
+    if qc:
+        trial_names = df_qc.loc[df_qc['Include'], 'Trial'].unique().tolist()
+    df_qc.insert(0, 'Condition', condition)
+    df_qc.insert(0, 'ID', subject_id)
+    if csv:
+        with report.stage("export"):
+            df_qc.drop(columns='ID').to_csv(os.path.join(save_path_dur, f"QC_{subject_id}_{condition}.csv"),
+                                            sep=",")
+
+    # Store fixations in new nested dictionaries -fixation_data- and -fixation_data_aoi-
+    with report.stage("fixation"):
+        keys = pd.MultiIndex.from_product([trial_names, PHASES, ["all"] + aoi_names],
+                                          names=['Trial', 'Phase', 'AOI']).to_frame(index=False)
+        df_fix_segments = pd.concat(fix_tables, ignore_index=True) if fix_tables else pd.DataFrame(
+            columns=list(keys.columns) + FIXATION_COLUMNS)
+        fix_segments = split_segments(df_fix_segments, keys)
+        # fixations have the format ['Start','End','Duration', 'X', 'Y']
+        fixation_data = {trial_name: {phase: fix_segments[(trial_name, phase, "all")] for phase in PHASES}
+                         for trial_name in trial_names}
+        fixation_data_aoi = {trial_name: {phase: {aoi_name: fix_segments[(trial_name, phase, aoi_name)]
+                                                  for aoi_name in aoi_names}
+                                          for phase in PHASES} for trial_name in trial_names}
+
+    # DLS for every combination of max_dist and min_dur (robustness checks)
+    if sweep is not None:
+        df_sweep = pd.concat(sweep_tables, ignore_index=True) if sweep_tables else pd.DataFrame(
+            columns=['Max_Dist', 'Min_Dur', 'Phase', 'Trial', 'Duration_Rise', 'Duration_Drop', 'Duration_Sum',
+                     'DLS'])
+        df_sweep = df_sweep.sort_values(
+            ['Max_Dist', 'Min_Dur', 'Phase'], kind='mergesort', ignore_index=True)
+        df_sweep.insert(2, 'Condition', condition)
+        df_sweep.insert(2, 'ID', subject_id)
+        if csv:
+            with report.stage("export"):
+                df_sweep.set_index(['Max_Dist', 'Min_Dur']).to_csv(
+                    os.path.join(save_path_dur, f"SWEEP_{subject_id}_{condition}.csv"), sep=",")
+
+    # Heatmaps per Trial, Phase and AOI (summed to heatmaps of the cohort with sum_heatmaps())
+    if heatmap_tile is not None and heatmaps:
+        with report.stage("export"):
+            heat_keys = pd.concat([keys for keys, _ in heatmaps], ignore_index=True)
+            heat_keys.insert(0, 'Condition', condition)
+            heat_keys.insert(0, 'ID', subject_id)
+            write_heatmaps(os.path.join(save_path_dur, f"HEAT_{subject_id}_{condition}.npz"), heat_keys,
+                           {name: np.concatenate([grids[name] for _, grids in heatmaps])
+                            for name in heatmaps[0][1]}, tile=heatmap_tile)
+
+    # Dwell time and fixations per Trial, Phase and AOI (group-by over labels and fixation table)
+    with report.stage("aggregation"):
+        df_aoi = pd.concat(aoi_tables, ignore_index=True) if aoi_tables else pd.DataFrame(
+            columns=['Trial', 'Phase', 'AOI', 'Samples', 'Dwell'])
+        df_aoi_fix = df_fix_segments.groupby(['Trial', 'Phase', 'AOI'], sort=False)['Duration'].agg(
+            N_Fixations='size', Duration_Fixations='sum').reset_index()
+        df_aoi = df_aoi.merge(df_aoi_fix, on=['Trial', 'Phase', 'AOI'], how='left').fillna(
+            {'N_Fixations': 0, 'Duration_Fixations': 0.})
+        df_aoi['N_Fixations'] = df_aoi['N_Fixations'].astype(int)
+        df_aoi.insert(0, 'Condition', condition)
+        df_aoi.insert(0, 'ID', subject_id)
+    if csv:
+        with report.stage("export"):
+            df_aoi.drop(columns='ID').to_csv(os.path.join(save_path_dur, f"AOI_{subject_id}_{condition}.csv"),
+                                             sep=",")
 
-    # Dataframe with Sum of Duration in AOI-drop per Trial
-    df_drop = compute_duration_drop(current_phase=PHASES[2],  # disruption phase
-                                    fix_data_drop=fixation_data_drop,
-                                    trial_names=trial_names)
+    if verbose:
+        # Description Dataset Fixations
+        for trial_name in trial_names:  # ~ trial_phase_data.keys():
+            for phase in PHASES:
+                print(f"Trial name: '{trial_name}' | Phase: '{phase}':\n")
+                print(len(fixation_data[trial_name][phase]))
+
+        # This can be used to test dictionaries
+        # *Note: You can iterate through trials and PHASES*
+        for trial_name in trial_names:
+            # ~ trial_phase_data.keys():  (Note: python list's are ordered, keys, hence dicts aren't)\n",
+            for phase in PHASES:  # ~ trial_phase_data[trial_name].keys():
+                print(f"Trial name: '{trial_name}' | Phase: '{phase}':\n")
+                print(fixation_data_aoi[trial_name][phase]['rise'].head())
+                print("\t\t...  ")
+                print(fixation_data_aoi[trial_name][phase]['rise'].tail(), "\n\n\n")
+                break
+            break
+
+    # At this point both fixation dictionaries are build. Variables can now be extracted for further analysis.
+    # fixation_data: contains fixation data for trials and PHASES
+    # fixation_data_aoi: contains only fixation data for all AOIs (e.g., 'drop' and 'rise')
+    # (gaze data per trial and PHASE (and AOI) is only held while the trial is processed, see process_trial())
 
     ###
-    # Dataframe with Sum of Duration in AOI-rise + AOI-drop + total Duration + DLS per Trial
+    # Calculate Parameters DLS, sum, mean and std for duration for each phase
     ###
-    add_drop_and_save(current_df_rise=df_rise, current_df_drop=df_drop, condition=FLAGS.condition,
-                      save_dir=SAVE_PATH_DF_RISE)
-
-    # Export Fixation Data to csv files per child, trial and phase
-    phase = PHASES[2]
-    for trial_name in trial_names:  # ~ trial_phase_data.keys():
-        df_fix = pd.DataFrame(columns=['Start', 'End', 'Duration', 'X', 'Y', 'Trial'])
-        df_fix_temp = fixation_data_rise[trial_name][phase]["rise"].copy()
-        df_fix = pd.concat([df_fix, df_fix_temp], ignore_index=True)
-        df_fix['Trial'] = trial_name
-        if len(df_fix) != 0:
-            df_fix.to_csv(os.path.join(
-                SAVE_PATH_FIXATION_OVERALL,
-                f"{phase}_fixation_{FLAGS.id}_{FLAGS.condition}_{trial_name}.csv"), sep=",")
+    with report.stage("aggregation"):
+        # Sum of Duration in AOI-rise + AOI-drop + total Duration + DLS per Trial and Phase in one group-by
+        groups = pd.MultiIndex.from_product([PHASES, trial_names], names=['Phase', 'Trial']).to_frame(index=False)
+        df_dur = compute_dls(df_fix_segments, by=['Phase', 'Trial'], groups=groups)
+        df_dur['Condition'] = condition
+        df_dur = df_dur[['Trial', 'Duration_Rise', 'Duration_Drop', 'Duration_Sum', 'DLS', 'Condition', 'Phase']]
+        if verbose:
+            print(summarize_dls(df_dur, by=['Phase']))
+
+    for phase in PHASES:
+        df_dur_phase = df_dur[df_dur['Phase'] == phase].drop(columns='Phase').reset_index(drop=True)
+        if verbose:
+            print(df_dur_phase)
+        if not csv:
+            continue
+        with report.stage("export"):
+            df_dur_phase.to_csv(os.path.join(save_path_dur, f"DUR_{subject_id}_{condition}_{phase.title()}.csv"),
+                                sep=",")
+
+            # Export Fixation Data to csv files per child, trial and phase
+            # (for the disruption phase only fixations in AOI rise are exported)
+            fix_data = fixation_data if phase != PHASES[2] else {
+                trial_name: {phase: fixation_data_aoi[trial_name][phase]["rise"]} for trial_name in trial_names}
+            df_fix_to_csv(current_phase=phase, fix_data=fix_data, trial_names=trial_names,
+                          subject_id=subject_id, condition=condition, save_dir=save_path_fix)
+
+    # Parameters of all PHASES
+    df_dur.insert(0, 'ID', subject_id)
+
+    # Fixations of all trials, phases and AOIs in one table
+    df_fix = df_fix_segments.copy()
+    df_fix.insert(0, 'Condition', condition)
+    df_fix.insert(0, 'ID', subject_id)
+
+    report.finish()
+    if report_dir is not None:
+        report.save(os.path.join(report_dir, f"RUN_{subject_id}_{condition}.json"))
+    tables = {"qc": df_qc, "durations": df_dur, "fixations": df_fix, "aoi": df_aoi}
+    if sweep is not None:
+        tables["sweep"] = df_sweep
+    return tables
+
+
+def main():
+    if FLAGS.clear_cache:
+        print(f"{clear_trial_cache(cache_dir=CACHE_PATH)} files removed from cache '{CACHE_PATH}'.")
+    if FLAGS.clear_store:
+        print(f"{clear_results(store_dir=RESULTS_PATH)} results removed from results store '{RESULTS_PATH}'.")
+
+    if FLAGS.all:
+        subjects = discover_subjects(DATA_ROOT_PATH)
+    else:
+        subjects = discover_subjects(DATA_ROOT_PATH, ids=FLAGS.id, conditions=FLAGS.condition)
+    if not subjects:
+        print(f"No subject data found in '{DATA_ROOT_PATH}' for ID(s) {FLAGS.id} and "
+              f"condition(s) {FLAGS.condition}.")
+        return
+    print("Subjects & conditions:\n", subjects)
+
+    kwargs = dict(data_root=DATA_ROOT_PATH, save_path_dur=SAVE_PATH_DF_RISE,
+                  save_path_fix=SAVE_PATH_FIXATION_OVERALL, use_cache=not FLAGS.no_cache, cache_dir=CACHE_PATH,
+                  aoi=FLAGS.aoi, verbose=not FLAGS.quiet, report_dir=FLAGS.report,
+                  trace_memory=FLAGS.trace_memory, csv=not FLAGS.no_csv, max_dist=FLAGS.max_dist,
+                  min_dur=FLAGS.min_dur, detector=FLAGS.detector, max_velocity=FLAGS.max_velocity,
+                  qc=not FLAGS.no_qc, use_store=not FLAGS.no_store, store_dir=RESULTS_PATH,
+                  resample_rate=FLAGS.resample, resample_max_gap=FLAGS.max_gap)
+    if FLAGS.heatmap_tile:
+        kwargs["heatmap_tile"] = FLAGS.heatmap_tile
+    if FLAGS.sweep_max_dist or FLAGS.sweep_min_dur:
+        kwargs["sweep"] = (FLAGS.sweep_max_dist or [FLAGS.max_dist], FLAGS.sweep_min_dur or [FLAGS.min_dur])
+    if len(subjects) == 1:
+        # Save all output tables of the subject in one dataset
+        tables = process_subject(*subjects[0], **kwargs)
+        tables["subjects"] = summarize_dls(tables["durations"], by=['ID', 'Condition', 'Phase'])
+        write_dataset(os.path.join(SAVE_PATH_DF_RISE, f"GSP_{subjects[0][0]}_{subjects[0][1]}.npz"), tables)
+        return
+
+    # Process whole cohort and collect the output tables of all subjects in one dataset
+    tables = process_cohort(subjects, jobs=FLAGS.jobs, **kwargs)
+    df_failed = tables["failed"]
+    if len(df_failed):
+        # Save failures with the cohort output and exit with error status after saving the other subjects
+        df_failed.to_csv(os.path.join(SAVE_PATH_DF_RISE, "FAILED_cohort.csv"), sep=",")
+        print(f"Processing failed for {len(df_failed)} of {len(subjects)} subject(s) & condition(s):\n",
+              df_failed[['ID', 'Condition']])
+    if "durations" not in tables:
+        sys.exit(1)
+    # Mean and std of durations and DLS per subject and for the whole cohort (over all trials)
+    tables["subjects"] = summarize_dls(tables["durations"], by=['ID', 'Condition', 'Phase'])
+    tables["cohort"] = summarize_dls(tables["durations"], by=['Condition', 'Phase'])
+    write_dataset(os.path.join(SAVE_PATH_DF_RISE, "GSP_cohort.npz"), tables)
+
+    # Heatmaps of the cohort per condition, phase and AOI from the saved heatmaps of all participants
+    if FLAGS.heatmap_tile:
+        paths = [os.path.join(SAVE_PATH_DF_RISE, f"HEAT_{subject_id}_{condition}.npz")
+                 for subject_id, condition in subjects]
+        heat_keys, heat_grids, tile = sum_heatmaps([path for path in paths if os.path.isfile(path)])
+        write_heatmaps(os.path.join(SAVE_PATH_DF_RISE, "HEAT_cohort.npz"), heat_keys, heat_grids, tile=tile)
+    print(tables["cohort"])
+    if not FLAGS.no_csv:
+        tables["qc"].to_csv(os.path.join(SAVE_PATH_DF_RISE, "QC_cohort.csv"), sep=",")
+        tables["durations"].to_csv(os.path.join(SAVE_PATH_DF_RISE, "DUR_cohort.csv"), sep=",")
+        tables["subjects"].to_csv(os.path.join(SAVE_PATH_DF_RISE, "DUR_cohort_subjects.csv"), sep=",")
+        tables["cohort"].to_csv(os.path.join(SAVE_PATH_DF_RISE, "DUR_cohort_summary.csv"), sep=",")
+        if "sweep" in tables:
+            tables["sweep"].set_index(['Max_Dist', 'Min_Dur']).to_csv(
+                os.path.join(SAVE_PATH_DF_RISE, "SWEEP_cohort.csv"), sep=",")
+    if len(df_failed):
+        sys.exit(1)
 
 
 # %% __main__ o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
 
 if __name__ == "__main__":
     # Setup parser
-    parser = argparse.ArgumentParser(description='Process subject in specific condition.')
-    parser.add_argument('--id', type=str, help='Subject ID', default=ID)
-    parser.add_argument('-c', '--condition', type=str, help='Condition', default=CONDITION)
+    parser = argparse.ArgumentParser(description='Process subject(s) in specific condition(s).')
+    parser.add_argument('--id', type=str, nargs='+', help='Subject ID(s) or glob pattern(s), e.g., "ID_5*"',
+                        default=[ID])
+    parser.add_argument('-c', '--condition', type=str, nargs='+', help='Condition(s)', default=[CONDITION])
+    parser.add_argument('--all', action='store_true',
+                        help='Process all subjects and conditions found in the data directory')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of parallel processes for cohort', default=1)
+    parser.add_argument('--no-cache', action='store_true', help='Parse trial csv files without binary cache')
+    parser.add_argument('--clear-cache', action='store_true', help='Clear binary cache of trial csv files first')
+    parser.add_argument('--no-store', action='store_true',
+                        help='Process all trials again instead of reusing unchanged results from results store')
+    parser.add_argument('--clear-store', action='store_true', help='Clear results store first')
+    parser.add_argument('--aoi', type=str, choices=list(AOI_DEFINITIONS), help='AOI definition', default=AOI)
+    parser.add_argument('-q', '--quiet', action='store_true', help='Do not print data per trial and phase')
+    parser.add_argument('--report', type=str, help='Path to save json run reports per subject',
+                        default=None)
+    parser.add_argument('--trace-memory', action='store_true', help='Add peak memory per stage to run reports')
+    parser.add_argument('--no-csv', action='store_true',
+                        help='Save output tables only in one dataset (GSP_*.npz), without csv files')
+    parser.add_argument('--no-qc', action='store_true',
+                        help='Process also trials not matching the inclusion criteria (QC table is saved anyway)')
+    parser.add_argument('--max-dist', type=float, help='Dispersion threshold of fixations in pixels',
+                        default=FIXATION_MAX_DIST)
+    parser.add_argument('--min-dur', type=float, help='Minimal duration of fixations in seconds',
+                        default=FIXATION_MIN_DUR)
+    parser.add_argument('--resample', type=float, nargs='?', const=RESAMPLE_RATE, default=None,
+                        help=f'Resample trials onto a uniform time grid with this rate in Hz before fixation '
+                             f'detection (default: {RESAMPLE_RATE:g})')
+    parser.add_argument('--max-gap', type=float, default=RESAMPLE_MAX_GAP,
+                        help='Longest gap of valid gaze data in seconds which is interpolated by --resample')
+    parser.add_argument('--detector', type=str, choices=FIXATION_DETECTORS, default=FIXATION_DETECTOR,
+                        help='Fixation detector: idt (dispersion threshold) or ivt (velocity threshold)')
+    parser.add_argument('--max-velocity', type=float, help='Velocity threshold of ivt fixations in pixels/s',
+                        default=FIXATION_MAX_VELOCITY)
+    parser.add_argument('--heatmap-tile', type=int, nargs='?', const=HEATMAP_TILE, default=None,
+                        help=f'Save gaze and fixation heatmaps with tiles of this size in pixels '
+                             f'(default: {HEATMAP_TILE}, blocks of the scratch grid)')
+    parser.add_argument('--sweep-max-dist', type=float, nargs='+',
+                        help='Compute DLS for each of these dispersion thresholds (parameter sweep)')
+    parser.add_argument('--sweep-min-dur', type=float, nargs='+',
+                        help='Compute DLS for each of these minimal durations (parameter sweep)')
 
     # Parse arguments
     FLAGS, unparsed = parser.parse_known_args()
@@ -0,0 +1,267 @@
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This script reconstructs offline what each participant uncovered in the contingent phase of the gaze scratch
+paradigm, by replaying the screen gaze data (see App.write_data()) through the tile logic of App.update_clock().
+
+The screen is covered by blocks of w_tiles x w_tiles pixels (see App.fill_image()). Every gaze sample of the
+contingent phase removes the block it falls on, until 20% of the blocks are removed or 30 seconds have passed.
+The replay is vectorized over the samples of a trial, and the trials of all participants are replayed in a
+process pool. For each participant and condition it saves:
+
+    REPLAY_{ID}_{CONDITION}_blocks.csv: removal time of every block per trial (NaN: not removed)
+    REPLAY_{ID}_{CONDITION}_course.csv: number and fraction of removed blocks over time per trial
+    REPLAY_{ID}_{CONDITION}_{TRIAL}.png: rendered scratch result per trial (instead of the screenshots)
+
+and a summary of all trials in REPLAY_cohort.csv, e.g.:
+
+    python GSP_Scratch_Replay.py --all --jobs 8 --out replay --stimuli Stimuli/trial_image
+
+The remaining blocks are rendered on top of the trial image, found in the stimuli directory by its file stem in the
+trial file name (e.g., '1sand_drop.png' for '3_52#...#1sand_drop.csv', see find_trial_image()). If no image is
+found for a trial, the blocks are rendered on a plain background (column 'Image' of the summary is empty).
+
+Author:  Florian Bednarski et al.
+Contact: fteichmann[at]cbs.mpg.de
+Years:   2021-2023
+"""
+
+# %% Import
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import GSP_Data_Processing as gsp
+
+# %% Set global vars & paths  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+SCREEN_SIZE = (1280, 1024)  # width, height in pixels, see App.__init__() in gaze_scratch_paradigm.py
+TILE: int = SCREEN_SIZE[0] // 16  # size of blocks in pixels (w_tiles, quadratic version)
+STOP_FRACTION: float = 0.2  # contingent phase ends when this fraction of blocks is removed ...
+CONTINGENT_MAX: float = 30.  # ... or after this time (in seconds)
+BLOCK_COLOR = (0x33, 0x99, 0xFF)  # "blue" in App.fill_image()
+BACKGROUND_COLOR = (0xFF, 0xFF, 0xFF)  # shown where blocks are removed (if no trial image is given)
+STIMULI_PATH: str = os.path.join("Stimuli", "trial_image")  # trial images, as in gaze_scratch_paradigm.py
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg"]
+
+
+# %% Functions  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+def replay_trial(time, x, y, contingent_start: int = None, tile: int = TILE, screen_size: tuple = SCREEN_SIZE,
+                 stop_fraction: float = STOP_FRACTION, max_duration: float = CONTINGENT_MAX) -> dict:
+    """
+    Replay the gaze samples of one trial through the scratch logic of App.update_clock().
+
+    A block is removed by the first sample falling on it (samples with NaN coordinates are skipped). The
+    contingent phase ends with the sample removing the last block needed for stop_fraction, or with the first
+    sample after max_duration (which still removes its block, as in App.process_samples()).
+
+    :param time: time stamps of gaze samples (in seconds, sorted)
+    :param x: x-coordinates of gaze samples (in pixels)
+    :param y: y-coordinates of gaze samples (in pixels, origin: top left corner of the screen)
+    :param contingent_start: index of the first sample of the contingent phase, None: see phase_index()
+    :param tile: size of blocks in pixels
+    :param screen_size: width, height of screen in pixels
+    :param stop_fraction: fraction of removed blocks which ends the contingent phase
+    :param max_duration: maximal duration of the contingent phase (in seconds)
+    :return: dict with
+             "removed": removal time of each block (rows x columns, in seconds after contingent start, NaN: kept),
+             "course": table with the columns 'Time', 'N_Removed', 'Fraction' (one row per removed block),
+             "duration": duration of the contingent phase (in seconds),
+             "stop": reason for the end of the contingent phase ('fraction', 'time' or 'data')
+    """
+    time = np.asarray(time, dtype=float)
+    if contingent_start is None:
+        contingent_start = gsp.phase_index(time)["contingent"][0]
+    n_rows, n_cols = gsp.heatmap_shape(tile, screen_size)
+    n_blocks = n_rows * n_cols
+    # Number of removed blocks which ends the contingent phase (same float comparison as in the experiment)
+    n_stop = int(np.argmax(np.arange(n_blocks + 1) / n_blocks >= stop_fraction))
+
+    # Samples of the contingent phase, up to and including the first sample after max_duration
+    t = time[contingent_start:] - time[contingent_start] if contingent_start < len(time) else np.empty(0)
+    n_samples = min(int(np.searchsorted(t, max_duration, side='right')) + 1, len(t))
+    t = t[:n_samples]
+    col = np.floor(np.asarray(x, dtype=float)[contingent_start:contingent_start + n_samples] / tile)
+    row = np.floor(np.asarray(y, dtype=float)[contingent_start:contingent_start + n_samples] / tile)
+    on_block = np.flatnonzero((col >= 0) & (col < n_cols) & (row >= 0) & (row < n_rows))
+
+    # Each block is removed by the first sample falling on it, in order of the samples
+    block = row[on_block].astype(np.intp) * n_cols + col[on_block].astype(np.intp)
+    block, first = np.unique(block, return_index=True)
+    order = np.argsort(first)[:n_stop]
+    block = block[order]
+    sample = on_block[first[order]]
+
+    if len(block) == n_stop:
+        stop, duration = "fraction", t[sample[-1]]
+    elif n_samples and t[-1] > max_duration:
+        stop, duration = "time", t[-1]
+    else:
+        stop, duration = "data", t[-1] if n_samples else 0.
+
+    removed = np.full(n_blocks, np.nan)
+    removed[block] = t[sample]
+    n_removed = np.arange(1, len(block) + 1)
+    return {"removed": removed.reshape(n_rows, n_cols),
+            "course": pd.DataFrame({'Time': t[sample], 'N_Removed': n_removed, 'Fraction': n_removed / n_blocks}),
+            "duration": duration, "stop": stop}
+
+
+def render_result(removed: np.ndarray, background: np.ndarray = None, tile: int = TILE,
+                  screen_size: tuple = SCREEN_SIZE, color: tuple = BLOCK_COLOR) -> np.ndarray:
+    """
+    Render the screen at the end of the contingent phase: remaining blocks on top of the (trial) image.
+
+    :param removed: removal time of each block (rows x columns, NaN: kept), see replay_trial()
+    :param background: RGB image (height x width x 3, uint8) shown where blocks are removed, placed at the top left
+                       corner of the screen as in the experiment, None: plain
+    :param color: RGB color of blocks
+    :return: RGB image (height x width x 3, uint8)
+    """
+    width, height = screen_size
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = BACKGROUND_COLOR
+    if background is not None:
+        background = np.asarray(background)[:height, :width, :3]
+        image[:background.shape[0], :background.shape[1]] = background
+    covered = np.isnan(removed).repeat(tile, axis=0).repeat(tile, axis=1)[:height, :width]
+    image[covered] = color
+    return image
+
+
+def find_trial_image(trial_name: str, stimuli_dir: str = STIMULI_PATH) -> str:
+    """
+    Find the image of a trial: the image in stimuli_dir whose file stem is part of the stem of the trial file name
+    (not preceded by a digit, the longest such stem if there are several).
+
+    :return: path to image, None if there is no such image (or no stimuli directory)
+    """
+    if not stimuli_dir or not os.path.isdir(stimuli_dir):
+        return None
+    trial_stem = os.path.splitext(trial_name)[0]
+    best = None
+    for fn in os.listdir(stimuli_dir):
+        image_stem, ext = os.path.splitext(fn)
+        if ext.lower() not in IMAGE_EXTENSIONS or not image_stem:
+            continue
+        i = trial_stem.rfind(image_stem)
+        if i < 0 or (i > 0 and trial_stem[i - 1].isdigit()):
+            continue
+        if best is None or len(image_stem) > len(os.path.splitext(best)[0]):
+            best = fn
+    return os.path.join(stimuli_dir, best) if best is not None else None
+
+
+def replay_subject(subject_id: str, condition: str, data_root: str = gsp.DATA_ROOT_PATH, save_dir: str = "",
+                   images: bool = True, tile: int = TILE, stimuli_dir: str = STIMULI_PATH) -> pd.DataFrame:
+    """
+    Replay all trials of one participant in one condition and save blocks, time course (and images).
+
+    :param images: save rendered scratch results as png files (requires Pillow)
+    :param stimuli_dir: directory of trial images (background of rendered results, see find_trial_image())
+    :return: summary table with one row per trial
+    """
+    subject_data_path = os.path.join(data_root, subject_id, condition.lower())
+    trial_names = sorted(os.listdir(subject_data_path))
+    n_rows, n_cols = gsp.heatmap_shape(tile, SCREEN_SIZE)
+    block_y, block_x = np.mgrid[0:n_rows * tile:tile, 0:n_cols * tile:tile]  # top left corner of blocks
+
+    blocks, courses, rows = [], [], []
+    for trial_name in trial_names:
+        trial_data = gsp.load_trial(os.path.join(subject_data_path, trial_name))
+        trial_data = trial_data.sort_values('time', kind='mergesort')
+        result = replay_trial(trial_data['time'], trial_data['gaze_point_x'], trial_data['gaze_point_y'],
+                              tile=tile)
+
+        blocks.append(pd.DataFrame({'Trial': trial_name, 'X': block_x.ravel(), 'Y': block_y.ravel(),
+                                    'Removed': result["removed"].ravel()}))
+        courses.append(result["course"].assign(Trial=trial_name))
+        n_removed = len(result["course"])
+        image_path = find_trial_image(trial_name, stimuli_dir)
+        rows.append([subject_id, condition, trial_name, n_removed, n_removed / result["removed"].size,
+                     result["duration"], result["stop"], os.path.basename(image_path) if image_path else ""])
+
+        if images:
+            from PIL import Image
+
+            background = None
+            if image_path is not None:
+                with Image.open(image_path) as trial_image:
+                    background = np.asarray(trial_image.convert("RGB"))
+            Image.fromarray(render_result(result["removed"], background=background, tile=tile)).save(os.path.join(
+                save_dir, f"REPLAY_{subject_id}_{condition}_{os.path.splitext(trial_name)[0]}.png"))
+
+    pd.concat(blocks, ignore_index=True).to_csv(
+        os.path.join(save_dir, f"REPLAY_{subject_id}_{condition}_blocks.csv"), sep=",")
+    df_course = pd.concat(courses, ignore_index=True)
+    df_course[['Trial', 'Time', 'N_Removed', 'Fraction']].to_csv(
+        os.path.join(save_dir, f"REPLAY_{subject_id}_{condition}_course.csv"), sep=",")
+    return pd.DataFrame(rows, columns=['ID', 'Condition', 'Trial', 'N_Removed', 'Fraction',
+                                       'Contingent_Duration', 'Stop', 'Image'])
+
+
+def replay_cohort(subjects: list, jobs: int = 1, **kwargs) -> pd.DataFrame:
+    """
+    Replay the trials of many participants and conditions in a process pool.
+
+    :param subjects: list of (subject ID, condition) tuples, see GSP_Data_Processing.discover_subjects()
+    :param jobs: number of worker processes (1: replay all subjects in this process)
+    :param kwargs: passed on to replay_subject()
+    :return: summary table with one row per trial of all subjects
+    """
+    if jobs > 1 and len(subjects) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(replay_subject, subject_id, condition, **kwargs)
+                       for subject_id, condition in subjects]
+            results = [future.result() for future in futures]
+    else:
+        results = [replay_subject(subject_id, condition, **kwargs) for subject_id, condition in subjects]
+    return pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+
+
+def main():
+    if FLAGS.all:
+        subjects = gsp.discover_subjects(FLAGS.data_root)
+    else:
+        subjects = gsp.discover_subjects(FLAGS.data_root, ids=FLAGS.id, conditions=FLAGS.condition)
+    if not subjects:
+        print(f"No subject data found in '{FLAGS.data_root}'.")
+        return
+
+    if FLAGS.out:
+        os.makedirs(FLAGS.out, exist_ok=True)
+    df_replay = replay_cohort(subjects, jobs=FLAGS.jobs, data_root=FLAGS.data_root, save_dir=FLAGS.out,
+                              images=not FLAGS.no_images, tile=FLAGS.tile, stimuli_dir=FLAGS.stimuli)
+    print(df_replay)
+    df_replay.to_csv(os.path.join(FLAGS.out, "REPLAY_cohort.csv"), sep=",")
+
+
+# %% __main__ o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+if __name__ == "__main__":
+    # Setup parser
+    parser = argparse.ArgumentParser(description='Replay the scratching of subject(s) from screen gaze data.')
+    parser.add_argument('--id', type=str, nargs='+', help='Subject ID(s) or glob pattern(s), e.g., "ID_5*"',
+                        default=[gsp.ID])
+    parser.add_argument('-c', '--condition', type=str, nargs='+', help='Condition(s)', default=[gsp.CONDITION])
+    parser.add_argument('--all', action='store_true',
+                        help='Replay all subjects and conditions found in the data directory')
+    parser.add_argument('--data-root', type=str, help='Path to data directory', default=gsp.DATA_ROOT_PATH)
+    parser.add_argument('-j', '--jobs', type=int, help='Number of parallel processes', default=1)
+    parser.add_argument('--out', type=str, help='Path to save results', default="")
+    parser.add_argument('--tile', type=int, help='Size of blocks in pixels', default=TILE)
+    parser.add_argument('--stimuli', type=str, help='Directory of trial images (background of rendered results)',
+                        default=STIMULI_PATH)
+    parser.add_argument('--no-images', action='store_true', help='Do not render scratch results as png')
+
+    # Parse arguments
+    FLAGS, unparsed = parser.parse_known_args()
+
+    # %% Run main
+    main()
+#  o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o END
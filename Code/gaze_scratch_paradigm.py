@@ -16,7 +16,10 @@ Years:   2021-2023
 """
 
 # %% Import
+from collections import deque
+import os
 from pathlib import Path
+import threading
 import time
 from time import perf_counter
 import tkinter as tk
@@ -24,8 +27,8 @@ import tobii_research as tr
 from PIL import Image, ImageTk
 import math
 import pygame
-import csv
 import vlc
+import numpy as np
 import pandas as pd
 import mss
 
@@ -38,6 +41,26 @@ import mss
 # Stimuli
 PATH_TO_STIMULI = Path("Stimuli")  # ADJUST PATH TO STIMULI IF REQUIRED
 
+# Scratch grid
+N_TILES: int = 16  # number of blocks along the width of the screen (resolution of the grid, blocks are quadratic)
+
+# Gaze samples of the contingent phase are handed from the eye tracker thread to the Tk thread in a bounded queue,
+# which is drained once per display frame (see App.process_samples())
+FRAME_MS: int = 16  # interval of redraws in milliseconds (~60 Hz display)
+QUEUE_SIZE: int = 4096  # maximal number of queued samples (> 3 s at 1200 Hz), the oldest samples are dropped
+
+# Fields of the Tobii gaze data (as_dictionary=True) which are recorded, with their types and dimensions
+TOBII_FIELDS = [('device_time_stamp', 'i8'), ('system_time_stamp', 'i8')] + [
+    (f'{eye}_{field}', dtype, *shape) for eye in ('left', 'right') for field, dtype, *shape in [
+        ('gaze_point_on_display_area', 'f8', (2,)), ('gaze_point_in_user_coordinate_system', 'f8', (3,)),
+        ('gaze_point_validity', 'i1'), ('pupil_diameter', 'f8'), ('pupil_validity', 'i1'),
+        ('gaze_origin_in_user_coordinate_system', 'f8', (3,)),
+        ('gaze_origin_in_trackbox_coordinate_system', 'f8', (3,)), ('gaze_origin_validity', 'i1')]]
+# ... plus system time (perf_counter()) and gaze point in screen coordinates
+GAZE_SAMPLE_DTYPE = np.dtype(TOBII_FIELDS + [('time', 'f8'), ('gaze_point_x', 'f8'), ('gaze_point_y', 'f8')])
+SAMPLE_CAPACITY: int = 2 ** 12  # preallocated samples per chunk (> 3 s at 1200 Hz), doubled when full
+WRITE_INTERVAL: float = 1.  # interval of writing the recorded samples to disk during the trial (in seconds)
+
 # List of attention getter videos
 attention_path = PATH_TO_STIMULI.joinpath("Attention")
 attention_videos = list(attention_path.glob("*.mp4"))
@@ -66,11 +89,153 @@ trial_images = sorted(trial_images, key=lambda x: int(x.name[:idx_first_char(x)]
 
 # %% Functions  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
 
+class GazeSampleStore:
+    """
+    Gaze samples of a trial in preallocated columns (numpy structured array of GAZE_SAMPLE_DTYPE).
+
+    Each sample is copied into the next row of the current chunk, no Python objects are kept per sample. The
+    samples are taken out chunk by chunk (see take()), hence only the samples since the last take are held in
+    memory. When a chunk is full, its capacity is doubled (amortized constant time per sample).
+    """
+
+    tobii_fields = GAZE_SAMPLE_DTYPE.names[:len(TOBII_FIELDS)]
+
+    def __init__(self, capacity: int = SAMPLE_CAPACITY):
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=GAZE_SAMPLE_DTYPE)
+        self.n_samples = 0  # samples in current chunk
+        self.n_taken = 0  # samples taken out before
+        self._lock = threading.Lock()  # the chunk is swapped by take() on another thread
+
+    def __len__(self):
+        """Number of all recorded samples."""
+        return self.n_taken + self.n_samples
+
+    def append(self, gaze_data: dict, sample_time: float, gaze_point_x: float, gaze_point_y: float):
+        """
+        Append one sample.
+
+        :param gaze_data: Tobii gaze data (as dictionary)
+        :param sample_time: system time of sample (perf_counter())
+        :param gaze_point_x: x-coordinate of gaze point on screen (in pixels)
+        :param gaze_point_y: y-coordinate of gaze point on screen (in pixels)
+        """
+        row = tuple([gaze_data[field] for field in self.tobii_fields]) + (sample_time, gaze_point_x, gaze_point_y)
+        with self._lock:
+            if self.n_samples == len(self.data):
+                self.data = np.concatenate([self.data, np.zeros_like(self.data)])
+            self.data[self.n_samples] = row
+            self.n_samples += 1
+
+    def take(self) -> np.ndarray:
+        """
+        Take out the samples recorded since the last take, recording continues in a new chunk.
+
+        :return: samples of GAZE_SAMPLE_DTYPE
+        """
+        chunk = np.zeros(self.capacity, dtype=GAZE_SAMPLE_DTYPE)
+        with self._lock:
+            samples = self.data[:self.n_samples]
+            self.data = chunk
+            self.n_taken += self.n_samples
+            self.n_samples = 0
+        return samples
+
+    @staticmethod
+    def tables(samples: np.ndarray):
+        """
+        Convert samples into the tables written by App.write_data().
+
+        :param samples: samples of GAZE_SAMPLE_DTYPE, see take()
+        :return: {"global": Tobii data (tuples stringified as written by pandas), "tobii": Tobii coordinates,
+                  "screen": screen coordinates}
+        """
+        global_data = {}
+        for field in GazeSampleStore.tobii_fields:
+            values = samples[field]
+            if values.ndim > 1:
+                text = values.astype(str)
+                joined = text[:, 0]
+                for i_dim in range(1, values.shape[1]):
+                    joined = np.char.add(np.char.add(joined, ", "), text[:, i_dim])
+                global_data[field] = np.char.add(np.char.add("(", joined), ")")
+            else:
+                global_data[field] = values
+        tobii_data = pd.DataFrame({'time': samples['device_time_stamp'],
+                                   'gaze_point_lx': samples['left_gaze_point_on_display_area'][:, 0],
+                                   'gaze_point_rx': samples['right_gaze_point_on_display_area'][:, 0],
+                                   'gaze_point_ly': samples['left_gaze_point_on_display_area'][:, 1],
+                                   'gaze_point_ry': samples['right_gaze_point_on_display_area'][:, 1]})
+        screen_data = pd.DataFrame({'time': samples['time'], 'gaze_point_x': samples['gaze_point_x'],
+                                    'gaze_point_y': samples['gaze_point_y']})
+        return {"global": pd.DataFrame(global_data), "tobii": tobii_data, "screen": screen_data}
+
+
+class GazeDataWriter(threading.Thread):
+    """
+    Write the gaze samples of a trial to the csv files in the background while they are recorded.
+
+    Every interval seconds the samples recorded since the last write are appended to temporary files next to
+    the csv files (which keep the data written so far if the experiment crashes), and released from the store.
+    close() writes the remaining samples and moves the temporary files to the csv files.
+    """
+
+    na_rep = {"global": "", "tobii": "nan", "screen": "nan"}  # as written by pandas resp. csv.DictWriter
+
+    def __init__(self, samples: GazeSampleStore, files: dict, interval: float = WRITE_INTERVAL):
+        """
+        :param samples: store of the gaze samples of the trial
+        :param files: {"global"|"tobii"|"screen": path to csv file}, files are completed in this order
+        :param interval: interval of writes (in seconds)
+        """
+        super().__init__(daemon=True)
+        self.samples = samples
+        self.files = files
+        self.interval = interval
+        self.n_written = 0
+        self._stop_event = threading.Event()
+
+        # Temporary files with header
+        self._tmp_files = {kind: f"{path}.{kind}.tmp" for kind, path in files.items()}
+        self._handles = {kind: open(path, "w", newline="") for kind, path in self._tmp_files.items()}
+        for kind, table in GazeSampleStore.tables(np.zeros(0, dtype=GAZE_SAMPLE_DTYPE)).items():
+            table.to_csv(self._handles[kind], index=False, header=True)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """Append the samples recorded since the last write to the temporary files."""
+        samples = self.samples.take()
+        if len(samples) == 0:
+            return
+        for kind, table in GazeSampleStore.tables(samples).items():
+            table.to_csv(self._handles[kind], index=False, header=False, na_rep=self.na_rep[kind])
+            self._handles[kind].flush()
+        self.n_written += len(samples)
+
+    def close(self) -> int:
+        """
+        Stop the background writes, write the remaining samples and complete the csv files.
+
+        :return: number of written samples
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.flush()
+        for kind, handle in self._handles.items():
+            handle.close()
+            os.replace(self._tmp_files[kind], self.files[kind])
+        return self.n_written
+
+
 class App:
     """This is the script that runs the experiment."""
 
     def __init__(self, image_idx: int, video_attention_idx: int, video_trial_idx: int,
-                 trial_idx: int, child_idx: int):
+                 trial_idx: int, child_idx: int, n_tiles: int = N_TILES):
 
         self.root = tk.Tk()
         # Load trial image
@@ -84,17 +249,24 @@ class App:
 
         self.w_screen = 1280  # adjust to your screen
         self.h_screen = 1024  # adjust to your screen
-        self.data_gaze = []
-        self.co_ordinate_list = []
-        self.global_gaze_data = []
-        self.w_tiles = self.w_screen // 16  # adjust to your screen
+        self.samples = GazeSampleStore()
+        self.writer = GazeDataWriter(self.samples, self.data_files())
+        self.w_tiles = self.w_screen // n_tiles  # adjust to your screen
         self.h_tiles = self.w_tiles  # quadratic version
-        # self.h_tiles = self.h_screen // 16  # perfect fit dependent on screen size
+        # self.h_tiles = self.h_screen // n_tiles  # perfect fit dependent on screen size
 
-        self.blocks = {}
-        self.n_block_removed = 0
+        self.blocks = None  # occupancy grid of blocks (rows x columns, True: covered), see 'def fill_image'
+        self.trial_photo = None  # init
+        self.scratch_photo = None  # init
+        self.n_block_removed = 0  # cells of the grid switched from covered to removed, see 'def update_clock'
         self.n_blocks = 0
 
+        # Samples of the contingent phase for the Tk thread (append/popleft of a deque are thread-safe)
+        self.sample_queue = deque(maxlen=QUEUE_SIZE)
+        self.frame_stats = {"frames": 0, "samples": 0, "dropped": 0, "removed": 0, "max_queue_depth": 0,
+                            "max_frame_samples": 0, "max_frame_removed": 0, "max_frame_time": 0.}
+        self.trial_done = False
+
         self.time_start = perf_counter()
         self.time_end = 0
         self.time_at_scratching_end = None  # init
@@ -105,6 +277,7 @@ class App:
         tr.find_all_eyetrackers()
         self.found_eyetrackers = tr.find_all_eyetrackers()
         self.my_eyetracker = self.found_eyetrackers[0]
+        self.writer.start()
         self.my_eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, self.gaze_data_callback_baseline,
                                         as_dictionary=True)
 
@@ -153,9 +326,11 @@ class App:
     # first we define how to and where to write the data (you might want to adjust this to you own needs
     # and preferences)
 
-    def write_data(self):
+    def data_files(self) -> dict:
         """
         We collected data in three formats
+
+        :return: {"global"|"tobii"|"screen": path to csv file}
         """
 
         # First the gaze data in the tobii coordinate system (0/0 top left corner of the screen
@@ -173,27 +348,18 @@ class App:
                        "#define some specification#" + self.trial_img.name.split(".")[0])
         print(file_global)
 
-        # This collects the global data
-        global_data = pd.DataFrame(self.global_gaze_data)
-        global_data.to_csv("%s.csv" % file_global, index=False, header=True)
-
-        # This collects the tobii coordinates data
-        with open("%s.csv" % file_tobii, "w", newline="") as file_a:
-            fieldnames_a = ['time', 'gaze_point_lx', 'gaze_point_rx', 'gaze_point_ly', 'gaze_point_ry']
-            writer_a = csv.DictWriter(file_a, fieldnames=fieldnames_a)
-            writer_a.writeheader()
-            for t, lx, rx, ly, ry in self.data_gaze:
-                writer_a.writerow({'time': t,
-                                   'gaze_point_lx': lx, 'gaze_point_rx': rx,
-                                   'gaze_point_ly': ly, 'gaze_point_ry': ry})
-
-        # This collects the matched to screen data
-        with open("%s.csv" % file_screen, "w", newline="") as file_b:
-            fieldnames_b = ['time', 'gaze_point_x', 'gaze_point_y']
-            writer_b = csv.DictWriter(file_b, fieldnames=fieldnames_b)
-            writer_b.writeheader()
-            for t, rx, lx in self.co_ordinate_list:
-                writer_b.writerow({'time': t, 'gaze_point_x': rx, 'gaze_point_y': lx})
+        # Global data, tobii coordinates data and matched to screen data
+        return {"global": "%s.csv" % file_global, "tobii": "%s.csv" % file_tobii, "screen": "%s.csv" % file_screen}
+
+    def write_data(self):
+        """
+        Complete the csv files of the trial.
+
+        The samples are written to disk during the trial (see GazeDataWriter), only the samples of the last
+        WRITE_INTERVAL are left to write.
+        """
+        n_samples = self.writer.close()
+        print('Samples written:', n_samples)
 
     def close_win(self):  # , e)
         """Kill the experiment once it is running."""
@@ -250,30 +416,41 @@ class App:
         self.my_eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA, self.gaze_data_callback_contingent,
                                         as_dictionary=True)
 
-        # Here we create rectangles on the screen in the color set above
+        # Here we cover the screen with blocks in the color set above: the image and the blocks (drawn through
+        # an alpha mask from the occupancy grid) are shown as one image on the canvas
         self.time_at_fill_image = perf_counter()
-        for x1 in range(0, self.w_screen, self.w_tiles):
-            x2 = x1 + self.w_tiles
-            for y1 in range(0, self.h_screen, self.h_tiles):
-                y2 = y1 + self.h_tiles
-                self.blocks[(x1, y1)] = self.canvas.create_rectangle(x1, y1, x2, y2, fill=cols[color])
-        self.n_blocks = len(self.blocks)
+        self.blocks = np.ones((-(-self.h_screen // self.h_tiles), -(-self.w_screen // self.w_tiles)), dtype=bool)
+        self.n_blocks = self.blocks.size
+
+        image = Image.new("RGB", (self.w_screen, self.h_screen))
+        with Image.open(self.trial_img) as trial_image:
+            image.paste(trial_image.convert("RGB"))
+        mask = self.blocks.repeat(self.h_tiles, axis=0).repeat(self.w_tiles, axis=1)
+        mask = mask[:self.h_screen, :self.w_screen]
+        self.trial_photo = ImageTk.PhotoImage(image)  # pixels of removed blocks are copied from here
+        self.scratch_photo = ImageTk.PhotoImage(Image.composite(
+            Image.new("RGB", image.size, cols[color]), image, Image.fromarray(mask.astype(np.uint8) * 255)))
+        self.canvas.itemconfig(self.image_on_canvas, image=self.scratch_photo)
+
+        # Start the scratching on the Tk thread
+        self.root.after(FRAME_MS, self.process_samples)
 
     def _gaza_data_callback_base(self, gaze_data):
-        self.global_gaze_data.append(gaze_data)
-        self.lx = gaze_data['left_gaze_point_on_display_area'][0]
-        self.ly = gaze_data['left_gaze_point_on_display_area'][1]
-        self.rx = gaze_data['right_gaze_point_on_display_area'][0]
-        self.ry = gaze_data['right_gaze_point_on_display_area'][1]
-        self.time = gaze_data['device_time_stamp']
+        """
+        Record a gaze sample.
 
-        # Get data and write to list
-        self.data_gaze.append((self.time, self.lx, self.rx, self.ly, self.ry))
+        :param gaze_data: ...
+        :return: system time, x- and y-coordinate of gaze point on screen
+        """
+        lx, ly = gaze_data['left_gaze_point_on_display_area']
+        rx, ry = gaze_data['right_gaze_point_on_display_area']
 
         # Convert eye-tracker data to screen
-        rx = (self.lx + ((self.rx - self.lx) / 2)) * self.w_screen
-        lx = (self.ly + ((self.ry - self.ly) / 2)) * self.h_screen
-        self.co_ordinate_list.append((perf_counter(), rx, lx))
+        sample = (perf_counter(), (lx + ((rx - lx) / 2)) * self.w_screen, (ly + ((ry - ly) / 2)) * self.h_screen)
+
+        # Get data and write to store
+        self.samples.append(gaze_data, *sample)
+        return sample
 
     def gaze_data_callback_baseline(self, gaze_data):
         """
@@ -300,37 +477,85 @@ class App:
         Contingent et function
 
         Data collections start when this function is called by 'def fill_image'.
+        This runs on the thread of the eye tracker: the sample is only recorded and queued, the scratching is
+        done on the Tk thread (see 'def process_samples').
 
         :param gaze_data: ...
         """
 
-        self._gaza_data_callback_base(gaze_data=gaze_data)
+        sample = self._gaza_data_callback_base(gaze_data=gaze_data)
 
-        # Set condition on when to move to disruption phase
-        # Here either 30second or until 20% of blocks removed
-        self.time_at_scratching_end = perf_counter()
-        if self.n_block_removed / self.n_blocks < 0.2:
-            if math.isnan(self.co_ordinate_list[-1][1]) or math.isnan(self.co_ordinate_list[-1][2]):
-                pass
-            else:
-                self.update_clock(self.co_ordinate_list[-1][1], self.co_ordinate_list[-1][2])
+        if len(self.sample_queue) == self.sample_queue.maxlen:
+            self.frame_stats["dropped"] += 1  # the oldest sample is dropped
+        self.sample_queue.append(sample)
 
-        if (
-                self.n_block_removed / self.n_blocks >= 0.2) or (
-                self.time_at_scratching_end - self.time_at_fill_image > 30):
-            self.my_eyetracker.unsubscribe_from(
-                tr.EYETRACKER_GAZE_DATA, self.gaze_data_callback_contingent)
-            print('Stop Contingent ET:', str(perf_counter()))
-            print('blocks removed:', self.n_block_removed)
-            print('blocks on screen:', self.n_blocks)
-            self.time_end = perf_counter()
+    def process_samples(self):
+        """
+        Apply the queued gaze samples of the contingent phase to the blocks, once per display frame.
+
+        The samples are run in order through 'def update_clock', all removed blocks are uncovered at once and the
+        canvas is redrawn once. The contingent phase ends after the sample which removed 20% of the blocks or
+        which came more than 30 seconds after the blocks were drawn.
+        """
+        frame_start = perf_counter()
+        self.frame_stats["max_queue_depth"] = max(self.frame_stats["max_queue_depth"], len(self.sample_queue))
+
+        removed = []
+        n_samples = 0
+        contingent_end = False
+        while self.sample_queue:
+            sample_time, eye_point_x, eye_point_y = self.sample_queue.popleft()
+            n_samples += 1
+
+            # Set condition on when to move to disruption phase
+            # Here either 30second or until 20% of blocks removed
+            self.time_at_scratching_end = sample_time
+            if self.n_block_removed / self.n_blocks < 0.2:
+                if not (math.isnan(eye_point_x) or math.isnan(eye_point_y)):
+                    block = self.update_clock(eye_point_x, eye_point_y)
+                    if block is not None:
+                        removed.append(block)
+
+            if (self.n_block_removed / self.n_blocks >= 0.2) or (
+                    self.time_at_scratching_end - self.time_at_fill_image > 30):
+                contingent_end = True
+                break
+
+        if removed:
+            self.uncover_blocks(removed)
+            self.canvas.update_idletasks()
+
+        stats = self.frame_stats
+        stats["frames"] += 1
+        stats["samples"] += n_samples
+        stats["removed"] += len(removed)
+        stats["max_frame_samples"] = max(stats["max_frame_samples"], n_samples)
+        stats["max_frame_removed"] = max(stats["max_frame_removed"], len(removed))
+        stats["max_frame_time"] = max(stats["max_frame_time"], perf_counter() - frame_start)
+
+        if contingent_end:
+            self.end_contingent()
+        else:
+            self.root.after(FRAME_MS, self.process_samples)
+
+    def end_contingent(self):
+        """End the contingent phase and start the disruption phase."""
+        self.my_eyetracker.unsubscribe_from(
+            tr.EYETRACKER_GAZE_DATA, self.gaze_data_callback_contingent)
+        self.sample_queue.clear()
+        print('Stop Contingent ET:', str(perf_counter()))
+        print('blocks removed:', self.n_block_removed)
+        print('blocks on screen:', self.n_blocks)
+        print('frames:', self.frame_stats)
+        self.time_end = perf_counter()
 
-            # Take screenshot of scratch result
-            self.take_screenshot(phase="Contingent")
+        # Take screenshot of scratch result
+        self.take_screenshot(phase="Contingent")
 
-            # Start disruption phase
-            self.my_eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA,
-                                            self.gaze_data_callback_disruption, as_dictionary=True)
+        # Start disruption phase
+        self.my_eyetracker.subscribe_to(tr.EYETRACKER_GAZE_DATA,
+                                        self.gaze_data_callback_disruption, as_dictionary=True)
+        self.root.after(FRAME_MS, self.check_trial_end)
 
     def take_screenshot(self, phase: str):
         """Take screenshot of the current screen."""
@@ -353,38 +578,63 @@ class App:
         self._gaza_data_callback_base(gaze_data=gaze_data)
 
         self.time_end = perf_counter()
-        if self.time_end - self.time_at_scratching_end > 5:
+        if self.time_end - self.time_at_scratching_end > 5 and not self.trial_done:
             print('Stop Disruption ET:', perf_counter())
             self.my_eyetracker.unsubscribe_from(tr.EYETRACKER_GAZE_DATA,
                                                 self.gaze_data_callback_disruption)
+            self.trial_done = True  # the trial is ended on the Tk thread (see 'def check_trial_end')
 
-            # Take screenshot of disruption result
-            self.take_screenshot(phase="Disruption")
+    def check_trial_end(self):
+        """End the trial on the Tk thread once the disruption phase is over."""
+        if not self.trial_done:
+            self.root.after(FRAME_MS, self.check_trial_end)
+            return
 
-            # End trial after 3 seconds
-            self.canvas.destroy()
-            time.sleep(3)  # time until the background image is removed
-            self.root.destroy()
+        # Take screenshot of disruption result
+        self.take_screenshot(phase="Disruption")
+
+        # End trial after 3 seconds
+        self.canvas.destroy()
+        self.root.after(3000, self.root.destroy)  # time until the background image is removed
 
     def update_clock(self, eye_point_x, eye_point_y):
         """
         Enable the gaze scratch effect.
 
-        Every last gaze point passed on from 'def gaze_data_callback_contingent' is run through this loop.
-        If there is still a block at this gaze point it is removed.
+        Every gaze point passed on from 'def process_samples' is run through this loop.
+        If there is still a block at this gaze point it is removed from the grid (it is uncovered on the screen by
+        'def uncover_blocks').
 
         :param eye_point_x:
         :param eye_point_y:
+        :return: row, column of the removed block, None if there is no block at this gaze point
         """
 
-        x_rounded = eye_point_x - eye_point_x % self.w_tiles
-        y_rounded = eye_point_y - eye_point_y % self.h_tiles
+        row = int(eye_point_y // self.h_tiles)
+        col = int(eye_point_x // self.w_tiles)
 
-        oval = self.blocks.pop((x_rounded, y_rounded), None)
-        if oval is not None:
-            self.canvas.delete(oval)
+        n_rows, n_cols = self.blocks.shape
+        if 0 <= row < n_rows and 0 <= col < n_cols and self.blocks[row, col]:
+            self.blocks[row, col] = False
             self.n_block_removed += 1
-            self.canvas.update()
+            return row, col
+        return None
+
+    def uncover_blocks(self, removed: list):
+        """
+        Show the image where blocks were removed.
+
+        Only the pixels of these blocks are copied from the image into the shown image.
+
+        :param removed: rows, columns of removed blocks (see 'def update_clock')
+        """
+        for row, col in removed:
+            x1 = col * self.w_tiles
+            y1 = row * self.h_tiles
+            x2 = min(x1 + self.w_tiles, self.w_screen)
+            y2 = min(y1 + self.h_tiles, self.h_screen)
+            self.root.tk.call(str(self.scratch_photo), 'copy', str(self.trial_photo),
+                              '-from', x1, y1, x2, y2, '-to', x1, y1)
 
 
 # %% __main__ o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
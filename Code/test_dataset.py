@@ -0,0 +1,82 @@
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the columnar dataset of output tables in GSP_Data_Processing.py (write_dataset() and read_dataset()).
+
+Reading partitions by the index of a table must give the same rows as filtering the whole table, e.g.:
+
+    python -m pytest Code/test_dataset.py
+
+Author:  Florian Bednarski et al.
+Contact: fteichmann[at]cbs.mpg.de
+Years:   2021-2023
+"""
+
+# %% Import
+import numpy as np
+import pandas as pd
+import pytest
+
+import GSP_Data_Processing as gsp
+
+# %% Set global vars  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+FILTERS = [{}, {"ID": "ID_2"}, {"ID": ["ID_3", "ID_1"], "Phase": "disruption"}, {"Trial": [2, 5], "AOI": "rise"},
+           {"ID": "ID_9"}, {"Condition": "Drop", "Duration": [0.5, 1.]}, {"Duration": 0.5}]
+
+
+# %% Fixtures  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+@pytest.fixture(scope="module")
+def fixations():
+    """Fixation table of a small cohort in random order."""
+    rng = np.random.default_rng(0)
+    n = 2000
+    return pd.DataFrame({'ID': rng.choice(["ID_1", "ID_2", "ID_3", "ID_10"], n),
+                         'Condition': rng.choice(["Rise", "Drop"], n),
+                         'Phase': rng.choice(gsp.PHASES, n),
+                         'Trial': rng.integers(1, 8, n),
+                         'AOI': rng.choice(["rise", "drop", "other"], n),
+                         'Duration': rng.choice([0.25, 0.5, 1.], n),
+                         'x': rng.normal(640, 100, n)})
+
+
+def _filtered(df: pd.DataFrame, filters: dict) -> pd.DataFrame:
+    mask = np.ones(len(df), dtype=bool)
+    for column, values in filters.items():
+        mask &= df[column].isin(np.atleast_1d(values)).to_numpy()
+    return df[mask].sort_values(['ID', 'Condition', 'Phase', 'Trial', 'AOI', 'x']).reset_index(drop=True)
+
+
+# %% Tests  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_read_partitions(fixations, tmp_path, filters):
+    path = str(tmp_path / "GSP_test.npz")
+    gsp.write_dataset(path, {"fixations": fixations, "empty": fixations.iloc[:0]})
+
+    df = gsp.read_dataset(path, "fixations", **filters)
+    pd.testing.assert_frame_equal(_filtered(df, {}), _filtered(fixations, filters), check_dtype=False)
+    assert gsp.read_dataset(path, "empty", **filters).empty
+
+
+def test_partitions_are_contiguous(fixations, tmp_path):
+    path = str(tmp_path / "GSP_test.npz")
+    gsp.write_dataset(path, {"fixations": fixations})
+
+    with np.load(path) as dataset:
+        offsets = dataset["fixations.partitions.offsets"]
+        n_partitions = len(fixations.groupby(['ID', 'Condition', 'Phase', 'Trial', 'AOI']))
+        assert len(offsets) == n_partitions + 1 and offsets[0] == 0 and offsets[-1] == len(fixations)
+        assert isinstance(gsp._dataset_column(path, dataset, "fixations/x"), np.memmap)
+
+
+def test_read_without_index(fixations, tmp_path):
+    # Datasets without index (e.g., written by an earlier version) are filtered row by row
+    path = str(tmp_path / "GSP_test.npz")
+    np.savez(path, **gsp._table_arrays("fixations", fixations))
+
+    df = gsp.read_dataset(path, "fixations", columns=['ID', 'Phase', 'Trial', 'AOI', 'x', 'Condition'],
+                          ID="ID_2", Phase="baseline")
+    pd.testing.assert_frame_equal(_filtered(df, {}), _filtered(fixations, {"ID": "ID_2", "Phase": "baseline"})
+                                  .drop(columns=['Duration'])[df.columns], check_dtype=False)
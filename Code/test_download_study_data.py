@@ -0,0 +1,150 @@
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the selective extraction of study data in GSP_Data_Processing.py (download_study_data()).
+
+A small archive in the layout of the OSF archive (stimuli and a nested 'Data/Data.zip') is served over a local
+http.server, with and without support of range requests, e.g.:
+
+    python -m pytest Code/test_download_study_data.py
+
+Author:  Florian Bednarski et al.
+Contact: fteichmann[at]cbs.mpg.de
+Years:   2021-2023
+"""
+
+# %% Import
+import functools
+import http.server
+import io
+import os
+import threading
+import zipfile
+
+import pytest
+
+import GSP_Data_Processing as gsp
+
+# %% Set global vars  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+SUBJECTS = ["ID_1", "ID_2"]
+CONDITIONS = ["rise", "drop"]
+STIMULI = {"Stimuli/trial_image/1sand_drop.png": b"png", "Stimuli/sound_A.mp3": b"mp3"}
+
+
+# %% Fixtures  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+def _trial_csv(subject_id: str, condition: str) -> bytes:
+    return f"time,gaze_point_x,gaze_point_y\n0.0,{subject_id},{condition}\n".encode()
+
+
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    """Serve files, answer range requests only if support_range is set, and record all requests."""
+
+    support_range = False
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.headers.get("Range"))
+        range_header = self.headers.get("Range")
+        if not (self.support_range and range_header):
+            return super().do_GET()  # ignores the Range header
+
+        with open(self.translate_path(self.path), "rb") as f:
+            data = f.read()
+        start, end = range_header.split("=", 1)[1].split("-")
+        end = min(int(end) if end else len(data) - 1, len(data) - 1)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(end - int(start) + 1))
+        self.end_headers()
+        self.wfile.write(data[int(start):end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def archive_url(tmp_path_factory):
+    """Url of the test archive on a local http server."""
+    serve_dir = tmp_path_factory.mktemp("server")
+    data_zip = io.BytesIO()
+    with zipfile.ZipFile(data_zip, "w") as zip_ref:
+        for subject_id in SUBJECTS:
+            for condition in CONDITIONS:
+                zip_ref.writestr(f"Data/{subject_id}/{condition}/1trial{condition}.csv",
+                                 _trial_csv(subject_id, condition))
+    with zipfile.ZipFile(serve_dir / "archive.zip", "w") as zip_ref:
+        for name, content in STIMULI.items():
+            zip_ref.writestr(name, content)
+        zip_ref.writestr("Data/Data.zip", data_zip.getvalue())
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                             functools.partial(_Handler, directory=str(serve_dir)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/archive.zip"
+    server.shutdown()
+
+
+@pytest.fixture(params=[False, True], ids=["download", "range"])
+def server(request, archive_url):
+    """Url of the test archive and the list of requests, with or without support of range requests."""
+    _Handler.support_range = request.param
+    _Handler.requests.clear()
+    return archive_url, _Handler.requests
+
+
+# %% Tests  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+def test_selective_extraction(server, tmp_path):
+    url, requests = server
+    gsp.download_study_data(stimuli_only=False, verbose=False, ids=["ID_1"], conditions=["Rise"],
+                            target_dir=str(tmp_path), url=url)
+
+    for name, content in STIMULI.items():
+        assert (tmp_path / name).read_bytes() == content
+    assert (tmp_path / "Data/ID_1/rise/1trialrise.csv").read_bytes() == _trial_csv("ID_1", "rise")
+    assert not (tmp_path / "Data/ID_1/drop").exists()
+    assert not (tmp_path / "Data/ID_2").exists()
+    assert not (tmp_path / "osfstorage-archive.zip").exists()  # downloaded archive is removed
+    assert (tmp_path / gsp.MANIFEST_NAME).is_file()
+    if _Handler.support_range:
+        assert all(header is not None for header in requests)  # archive is read remotely
+
+
+def test_repeated_setup_skips_archive(server, tmp_path):
+    url, requests = server
+    kwargs = dict(stimuli_only=False, verbose=False, ids=["ID_*"], conditions=["rise"], target_dir=str(tmp_path),
+                  url=url)
+    gsp.download_study_data(**kwargs)
+    assert requests
+
+    # All requested files present: the archive is neither read nor downloaded
+    requests.clear()
+    gsp.download_study_data(**kwargs)
+    gsp.download_study_data(**dict(kwargs, stimuli_only=True))
+    gsp.download_study_data(**dict(kwargs, ids=["ID_2"]))
+    assert requests == []
+
+    # Missing file (or new subset) is extracted again
+    os.remove(tmp_path / "Data/ID_2/rise/1trialrise.csv")
+    gsp.download_study_data(**kwargs)
+    assert requests
+    assert (tmp_path / "Data/ID_2/rise/1trialrise.csv").read_bytes() == _trial_csv("ID_2", "rise")
+    requests.clear()
+    gsp.download_study_data(**dict(kwargs, conditions=None))
+    assert requests
+    assert (tmp_path / "Data/ID_1/drop/1trialdrop.csv").is_file()
+
+
+def test_local_archive_is_kept(archive_url, tmp_path):
+    # The archive given as local file is not removed, even if it has the name of a downloaded archive
+    from urllib.request import urlopen
+
+    archive_path = tmp_path / "osfstorage-archive.zip"
+    with urlopen(archive_url) as response:
+        archive_path.write_bytes(response.read())
+    gsp.download_study_data(stimuli_only=True, verbose=False, target_dir=str(tmp_path), url=str(archive_path))
+
+    assert archive_path.is_file()
+    assert (tmp_path / "Stimuli/sound_A.mp3").read_bytes() == STIMULI["Stimuli/sound_A.mp3"]
@@ -0,0 +1,107 @@
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Equivalence tests of the array-native fixation engine in GSP_Data_Processing.py.
+
+fixation_detection_np() and fixation_detection_segments() must give exactly the fixations of the reference
+fixation_detection() (PyTrack), including ties at max_dist and track loss (NaN), e.g.:
+
+    python -m pytest Code/test_fixation_detection.py
+
+Author:  Florian Bednarski et al.
+Contact: fteichmann[at]cbs.mpg.de
+Years:   2021-2023
+"""
+
+# %% Import
+import numpy as np
+import pytest
+
+import GSP_Data_Processing as gsp
+
+# %% Set global vars  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+SEEDS = range(8)
+SAMPLING_RATES = [120, 300, 600]  # in Hz
+PARAMETERS = [(25, 0.25), (10, 0.1), (40, 0.5), (5, 0.)]  # (max_dist, min_dur)
+
+
+# %% Helpers  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+def _gaze_trace(seed: int, sampling_rate: float, duration: float = 20., integer: bool = False):
+    """Random walk of fixations (small jitter) and saccades (jumps) with NaN gaps."""
+    rng = np.random.default_rng(seed)
+    n = int(duration * sampling_rate)
+    time = np.cumsum(rng.uniform(.9, 1.1, n)) / sampling_rate
+    jump = rng.random(n) < 2 / sampling_rate  # ~2 saccades per second
+    x = np.cumsum(np.where(jump, rng.normal(0, 200, n), rng.normal(0, 3, n))) + 640
+    y = np.cumsum(np.where(jump, rng.normal(0, 200, n), rng.normal(0, 3, n))) + 512
+    if integer:
+        x, y = np.round(x), np.round(y)
+    gap = rng.random(n) < .01
+    x[gap] = np.nan
+    y[gap] = np.nan
+    return x, y, time
+
+
+def _tie_trace(max_dist: int, n: int = 400):
+    """Samples at exactly max_dist (3-4-5 offsets) from the fixation start, and jumps away."""
+    k = max_dist // 5
+    offsets = np.array([(0, 0), (3 * k, 4 * k), (-4 * k, 3 * k), (0, -5 * k), (5 * k, 0), (0, 0)], dtype=float)
+    x = np.empty(n)
+    y = np.empty(n)
+    for i in range(n):
+        block = i // 30  # new fixation position every 30 samples
+        x[i] = 100. + 7 * max_dist * block + offsets[i % len(offsets), 0]
+        y[i] = 300. + offsets[i % len(offsets), 1]
+    time = np.arange(n) / 120.
+    return x, y, time
+
+
+def _reference(x, y, time, max_dist, min_dur) -> np.ndarray:
+    _, e_fix = gsp.fixation_detection(x.tolist(), y.tolist(), time.tolist(), max_dist=max_dist, min_dur=min_dur)
+    return np.array(e_fix, dtype=float).reshape(-1, 5)
+
+
+def _as_table(e_fix: np.ndarray) -> np.ndarray:
+    return np.column_stack([e_fix[field] for field in ['start', 'end', 'duration', 'x', 'y']]).reshape(-1, 5)
+
+
+# %% Tests  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+@pytest.mark.parametrize("max_dist, min_dur", PARAMETERS)
+@pytest.mark.parametrize("sampling_rate", SAMPLING_RATES)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_np_equals_reference(seed, sampling_rate, max_dist, min_dur):
+    x, y, time = _gaze_trace(seed, sampling_rate, integer=seed % 2 == 1)
+    np.testing.assert_array_equal(_as_table(gsp.fixation_detection_np(x, y, time, max_dist, min_dur)),
+                                  _reference(x, y, time, max_dist, min_dur))
+
+
+@pytest.mark.parametrize("max_dist", [5, 25, 50])
+def test_np_equals_reference_at_max_dist(max_dist):
+    x, y, time = _tie_trace(max_dist)
+    expected = _reference(x, y, time, max_dist, min_dur=0.1)
+    assert len(expected) > 0
+    np.testing.assert_array_equal(_as_table(gsp.fixation_detection_np(x, y, time, max_dist, 0.1)), expected)
+
+
+def test_np_empty():
+    e_fix = gsp.fixation_detection_np([], [], [])
+    assert len(e_fix) == 0
+    assert len(_reference(np.empty(0), np.empty(0), np.empty(0), 25, 0.25)) == 0
+
+
+@pytest.mark.parametrize("max_dist, min_dur", PARAMETERS)
+@pytest.mark.parametrize("seed", SEEDS)
+def test_segments_equal_np(seed, max_dist, min_dur):
+    x, y, time = _gaze_trace(seed, sampling_rate=[120, 300, 600][seed % 3], integer=seed % 2 == 1)
+    rng = np.random.default_rng(seed)
+    inner = np.sort(rng.choice(np.arange(1, len(x)), size=12, replace=False))
+    offsets = np.concatenate([[0], inner, [inner[-1]], [len(x)]])  # with an empty segment
+
+    e_fix = gsp.fixation_detection_segments(x, y, time, offsets, max_dist=max_dist, min_dur=min_dur)
+    for i_segment in range(len(offsets) - 1):
+        start, stop = offsets[i_segment], offsets[i_segment + 1]
+        expected = gsp.fixation_detection_np(x[start:stop], y[start:stop], time[start:stop], max_dist, min_dur)
+        np.testing.assert_array_equal(_as_table(e_fix[e_fix['segment'] == i_segment]), _as_table(expected))
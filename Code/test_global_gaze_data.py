@@ -0,0 +1,55 @@
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the streaming of 'global' Tobii files in GSP_Data_Processing.py (iter_global_gaze_data()).
+
+All batches of a file must have the same columns and types, also batches with missing samples (track loss), e.g.:
+
+    python -m pytest Code/test_global_gaze_data.py
+
+Author:  Florian Bednarski et al.
+Contact: fteichmann[at]cbs.mpg.de
+Years:   2021-2023
+"""
+
+# %% Import
+import numpy as np
+import pandas as pd
+
+import GSP_Data_Processing as gsp
+
+# %% Set global vars  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+HEADER = ("device_time_stamp,left_gaze_point_on_display_area,left_gaze_point_validity,left_pupil_diameter,"
+          "left_gaze_origin_in_user_coordinate_system")
+ROWS = ['100,"(0.5, 0.4)",1,3.1,"(10.0, 20.0, 600.0)"',
+        '101,"(0.6, 0.4)",1,3.2,"(10.5, 20.0, 600.0)"',
+        ',,,,',  # batch without any samples
+        ',,,,',
+        '104,"(nan, nan)",0,,"(nan, nan, nan)"']
+
+
+# %% Tests  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+def test_batches_have_same_schema(tmp_path):
+    csv_path = tmp_path / "global.csv"
+    csv_path.write_text("\n".join([HEADER] + ROWS) + "\n")
+
+    batches = list(gsp.iter_global_gaze_data(str(csv_path), chunksize=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    for batch in batches:
+        pd.testing.assert_series_equal(batch.dtypes, batches[0].dtypes)
+    assert batches[0].dtypes.to_dict() == {
+        'device_time_stamp': pd.Int64Dtype(),
+        'left_gaze_point_on_display_area_x': np.float64, 'left_gaze_point_on_display_area_y': np.float64,
+        'left_gaze_point_validity': pd.Int8Dtype(), 'left_pupil_diameter': np.float64,
+        'left_gaze_origin_in_user_coordinate_system_x': np.float64,
+        'left_gaze_origin_in_user_coordinate_system_y': np.float64,
+        'left_gaze_origin_in_user_coordinate_system_z': np.float64}
+
+    data = pd.concat(batches)
+    assert data['device_time_stamp'].tolist() == [100, 101, pd.NA, pd.NA, 104]
+    assert data['left_gaze_point_validity'].tolist() == [1, 1, pd.NA, pd.NA, 0]
+    np.testing.assert_array_equal(data['left_gaze_point_on_display_area_x'], [.5, .6, np.nan, np.nan, np.nan])
+    np.testing.assert_array_equal(data['left_gaze_origin_in_user_coordinate_system_z'],
+                                  [600., 600., np.nan, np.nan, np.nan])
@@ -0,0 +1,63 @@
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the failure handling of cohort runs in GSP_Data_Processing.py (process_cohort() and the command line).
+
+A synthetic cohort (see GSP_Benchmark.generate_cohort()) with one broken trial file is processed; the other
+participants must be processed, the failure must be reported and the command line must exit with error, e.g.:
+
+    python -m pytest Code/test_process_cohort.py
+
+Author:  Florian Bednarski et al.
+Contact: fteichmann[at]cbs.mpg.de
+Years:   2021-2023
+"""
+
+# %% Import
+import os
+import subprocess
+import sys
+
+import pytest
+
+import GSP_Benchmark as bench
+import GSP_Data_Processing as gsp
+
+# %% Set global vars  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+BROKEN_SUBJECT = "ID_2"
+
+
+# %% Fixtures  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+@pytest.fixture
+def cohort(tmp_path):
+    """Working directory with a cohort in './Data', the trial file of BROKEN_SUBJECT misses all gaze columns."""
+    subjects = bench.generate_cohort(str(tmp_path / "Data"), n_subjects=3, n_trials=2)
+    with open(tmp_path / "Data" / BROKEN_SUBJECT / "rise" / "1trialrise.csv", "w") as f:
+        f.write("foo\n1\n")
+    return tmp_path, subjects
+
+
+# %% Tests  >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o >><< o
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_process_cohort_collects_failures(cohort, jobs):
+    work_dir, subjects = cohort
+    tables = gsp.process_cohort(subjects, jobs=jobs, data_root=str(work_dir / "Data"), save_path_dur=str(work_dir),
+                                save_path_fix=str(work_dir), use_cache=False, verbose=False, use_store=False)
+
+    assert tables["failed"][['ID', 'Condition']].values.tolist() == [[BROKEN_SUBJECT, "Rise"]]
+    assert "ValueError" in tables["failed"]['Error'].iloc[0]
+    assert sorted(tables["durations"]['ID'].unique()) == ["ID_1", "ID_3"]
+
+
+def test_cli_exits_with_error(cohort):
+    work_dir, _ = cohort
+    process = subprocess.run([sys.executable, os.path.abspath(gsp.__file__), "--all", "--quiet", "--no-cache",
+                              "--no-store", "--no-csv"], cwd=work_dir, capture_output=True, text=True)
+
+    assert process.returncode != 0
+    assert (work_dir / "FAILED_cohort.csv").is_file()
+    assert gsp.read_dataset(str(work_dir / "GSP_cohort.npz"), "failed", columns=['ID'])['ID'].tolist() == \
+        [BROKEN_SUBJECT]